@@ -2,10 +2,15 @@ import getpass
 import os
 import configparser
 import urllib.parse
+import sys
 
 from sqlalchemy import create_engine
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from prio_grid import assign_gid
+from sql_cache import cached_read_sql
+
 
 # set up the connection to the database
 SQL_HOST = "hpcc-sql.wharton.upenn.edu"
@@ -29,38 +34,14 @@ engine = create_engine(
 
 sql = "SELECT ActionGeo_Lat, ActionGeo_Long FROM gdelt_events where Year = 2011 LIMIT 1000;"
 
-df = pd.read_sql(sql, engine)
+#Read through the local query cache, the server is only queried the first time
+df = cached_read_sql(sql, engine, "gdelt_events", 2011)
 #print(df.head())
 
 gid = pd.read_csv("PRIO GRID spine.csv")
 #print(gid.head())
 
 #Round of the coordinates in the GDELT EVENTS data to .25, .50, .75, .00 (that's how it is in PRIO GRID Spine)
-pg_lat = []
-pg_long = []
-
-def lat_long_to_PG_lat_long(x,list_lat_long):
-	for i in range(len(x)):
-		if x[i] >= 0:
-			if x[i] % 1 >= 0 and x[i] % 1 <= 0.5:
-				list_lat_long.append(int(x[i]) + 0.25)
-			else:
-				list_lat_long.append(int(x[i]) + 0.75)
-
-		if x[i] < 0:
-			if x[i] % 1 >= 0 and x[i] % 1 <= 0.5:
-				list_lat_long.append(int(x[i]) - 0.75)
-			else:
-				list_lat_long.append(int(x[i]) - 0.25)
-
-
-lat_long_to_PG_lat_long(df["ActionGeo_Lat"],pg_lat)
-lat_long_to_PG_lat_long(df["ActionGeo_Long"],pg_long)
-
-df['pg_lat'] = pg_lat
-df['pg_long'] = pg_long
-
-#print(df)
-
-a = df.merge(gid, how = "left", left_on = ["pg_lat","pg_long"], right_on = ["lat","lon"])
-print(a)
+#and compute the PRIO GRID gid directly, no loop and no merge on the float lat/lon columns
+df = assign_gid(df, "ActionGeo_Lat", "ActionGeo_Long", spine_gids=gid["gid"])
+print(df)
@@ -1,48 +1,96 @@
 import getpass
 import os
+import sys
 import configparser
 import urllib.parse
 
 from sqlalchemy import create_engine
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from hpcc_extract import fetch_partitions, read_partitions
+from sql_cache import CACHE_DIR, invalidate
+from actor_pairs import BUS_LAB, compile_query, split_directions
+
 
 # set up the connection to the database
 SQL_HOST = "hpcc-sql.wharton.upenn.edu"
 SQL_DB = "GDELT"
-SQL_USER = getpass.getuser()
-config = configparser.ConfigParser()
-config.read(f"{os.environ['HOME']}/.my.cnf")
-SQL_PASS = config["client"]["password"]
 
-# fix up pass if it needs fixing for SQL Alchemy URL
+# Years to pull
+START_YEAR = 1990
+END_YEAR = 2021
+
+# Number of queries run at the same time, each one holds its own connection.
+# Set this to what the HPCC MariaDB server allows per user.
+MAX_CONNECTIONS = 8
+
+# Number of times a failed year is retried before giving up on it
+RETRIES = 3
+
+# Local query cache, years that were already pulled are read from disk instead of the server.
+# Set USE_CACHE to False to always query the server. Years in REFRESH_YEARS (e.g. the
+# newest, still changing year) are dropped from the cache and pulled again.
+USE_CACHE = True
+REFRESH_YEARS = []
+
+# Actor pairs to pull (see actor_pairs.py). Both directions come from one query per year
+# and every row is tagged with its direction (bus_lab or lab_bus).
+PAIRS = BUS_LAB
+DATASET = "bus_lab_pairs"
 
-SQL_PASS = urllib.parse.quote_plus(SQL_PASS)
+# "parquet" streams every year straight into the DATASET directory (Year=YYYY partitions),
+# "csv" additionally exports bus_lab.csv and lab_bus.csv like before
+OUTPUT_FORMAT = "parquet"
 
 
-# create a connection to the DB server
+# Method to create a connection to the DB server
+def get_engine(pool_size=MAX_CONNECTIONS):
+    SQL_USER = getpass.getuser()
+    config = configparser.ConfigParser()
+    config.read(f"{os.environ['HOME']}/.my.cnf")
+    SQL_PASS = config["client"]["password"]
 
-engine = create_engine(
-    f"mariadb+pymysql://{SQL_USER}:{SQL_PASS}@{SQL_HOST}/{SQL_DB}?charset=utf8mb4"
-)
+    # fix up pass if it needs fixing for SQL Alchemy URL
+    SQL_PASS = urllib.parse.quote_plus(SQL_PASS)
 
-sql = f"SELECT * FROM gdelt_events where Year = 1990 and (Actor1Code LIKE 'BUS' OR Actor1Code LIKE 'MNC') and Actor2Code LIKE 'LAB';"
-bus_lab = pd.read_sql(sql,engine)
+    return create_engine(
+        f"mariadb+pymysql://{SQL_USER}:{SQL_PASS}@{SQL_HOST}/{SQL_DB}?charset=utf8mb4",
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_pre_ping=True,
+    )
 
-sql = f"SELECT * FROM gdelt_events where Year = 1990 and (Actor2Code LIKE 'BUS' OR Actor2Code LIKE 'MNC') and Actor1Code LIKE 'LAB';"
-lab_bus = pd.read_sql(sql,engine)
 
-for i in range(1991,2022):
-	print(i)
+# Method to stream every year into the DATASET parquet dataset.
+# Years are fetched in parallel over MAX_CONNECTIONS connections,
+# results are reported in year order. Returns the list of failed partitions.
+def fetch_all(engine, start_year=START_YEAR, end_year=END_YEAR, max_workers=MAX_CONNECTIONS):
+    tasks = [(DATASET, i, compile_query(PAIRS, i)) for i in range(start_year, end_year + 1)]
+    cache_dir = CACHE_DIR if USE_CACHE else None
+    results = fetch_partitions(engine, tasks, max_workers=max_workers, retries=RETRIES, cache_dir=cache_dir)
+    failed = []
+    for (name, i), n in results.items():
+        if isinstance(n, Exception):
+            print(f"{i} {name}: failed ({n})")
+            failed.append((name, i))
+        else:
+            print(f"{i} {name}: {n} rows")
+    return failed
 
-	sql = f"SELECT * FROM gdelt_events where Year = {i} and (Actor1Code LIKE 'BUS' OR Actor1Code LIKE 'MNC') and Actor2Code LIKE 'LAB';"
-	bus_lab = pd.concat([bus_lab, pd.read_sql(sql,engine)]) 
 
-	sql = f"SELECT * FROM gdelt_events where Year = {i} and (Actor2Code LIKE 'BUS' OR Actor2Code LIKE 'MNC') and Actor1Code LIKE 'LAB';"
-	lab_bus = pd.concat([lab_bus, pd.read_sql(sql,engine)]) 		
+if __name__ == "__main__":
+    for i in REFRESH_YEARS:
+        invalidate("gdelt_events", i)
 
-print(bus_lab)
-bus_lab.to_csv("bus_lab.csv",index=False)
+    engine = get_engine()
+    failed = fetch_all(engine)
+    if failed:
+        raise SystemExit(f"Failed partitions: {failed}")
 
-print(lab_bus)
-lab_bus.to_csv("lab_bus.csv",index=False)
+    # Export one year at a time so the CSV is never built in memory
+    if OUTPUT_FORMAT == "csv":
+        for i in range(START_YEAR, END_YEAR + 1):
+            df = read_partitions(DATASET, years=[i])
+            for name, part in split_directions(df, PAIRS).items():
+                part.to_csv(f"{name}.csv", index=False, mode="w" if i == START_YEAR else "a", header=i == START_YEAR)
@@ -0,0 +1,141 @@
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from sql_cache import cached_file
+from gdelt_store import to_table
+
+# Number of rows pulled from the server per chunk. Memory use is bounded by one chunk.
+CHUNK_SIZE = 100_000
+
+
+# Method to get the path of one year partition of a parquet dataset (hive style, Year=YYYY)
+def partition_path(out_dir, year):
+    return os.path.join(out_dir, f"Year={year}", "part-0.parquet")
+
+
+# Method to build an arrow table for a chunk, with the types of the events store (see
+# gdelt_store.py: dictionary encoded codes, float32 coordinates, int32 SQLDATE and the gid of
+# every event). Columns that are all NULL in the first chunk have no type yet, so they are
+# written as strings to keep the schema stable.
+def chunk_to_table(chunk, schema=None):
+    table = to_table(chunk)
+    if schema is None:
+        fields = [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema]
+        return table.cast(pa.schema(fields))
+    return table.cast(schema)
+
+
+# Method to stream the result of one query into a parquet file.
+# The query is read through a server side cursor (stream_results) in chunks of
+# chunksize rows and every chunk is appended to the file as a row group, so nothing
+# but the current chunk is held in memory. An empty result still writes an (empty) file.
+# Returns the number of rows written.
+def stream_to_file(engine, sql, path, chunksize=CHUNK_SIZE):
+    writer = None
+    n_rows = 0
+    try:
+        with engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+            for chunk in pd.read_sql(sql, conn, chunksize=chunksize):
+                # Year is carried by the partition directory, not stored in the file
+                chunk = chunk.drop(columns="Year", errors="ignore")
+                if writer is None:
+                    table = chunk_to_table(chunk)
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    table = chunk_to_table(chunk, writer.schema)
+                writer.write_table(table)
+                n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        pq.write_table(pa.table({}), path)
+    return n_rows
+
+
+# Method to hard link a file (cheap, same disk) or copy it if linking is not possible
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+# Method to stream the result of one query into a single year partition of out_dir.
+# With a cache_dir the result goes through the local query cache (see sql_cache.py),
+# so a year that is already cached is not queried again.
+# The partition is only replaced once the whole year has been read. Returns the number of rows.
+def stream_to_parquet(engine, sql, out_dir, year, chunksize=CHUNK_SIZE, cache_dir=None, table="gdelt_events"):
+    path = partition_path(out_dir, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    if cache_dir is None:
+        stream_to_file(engine, sql, tmp_path, chunksize)
+    else:
+        fetch = lambda p: stream_to_file(engine, sql, p, chunksize)
+        link_or_copy(cached_file(sql, table, year, fetch, cache_dir), tmp_path)
+
+    n_rows = pq.ParquetFile(tmp_path).metadata.num_rows
+    if n_rows > 0:
+        os.replace(tmp_path, path)
+        # Replacing a hard link of the same cached file does nothing and leaves tmp_path behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    else:
+        os.remove(tmp_path)
+        if os.path.exists(path):
+            os.remove(path)
+    return n_rows
+
+
+# Method to stream one partition, retrying it up to retries times (waiting a bit longer each time)
+def fetch_partition(engine, sql, out_dir, year, retries=3, wait=5, chunksize=CHUNK_SIZE, cache_dir=None):
+    for attempt in range(retries + 1):
+        try:
+            return stream_to_parquet(engine, sql, out_dir, year, chunksize, cache_dir)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"{out_dir} {year} failed ({e}), retrying")
+            time.sleep(wait * (attempt + 1))
+
+
+# Method to fetch many (out_dir, year, sql) partitions in parallel.
+# Every partition is written to its own file, so the workers never share a writer.
+# max_workers should not be larger than the engine's pool size (see get_engine).
+# Returns {(out_dir, year): rows or the exception} in the same order as tasks,
+# failed partitions do not stop the others.
+def fetch_partitions(engine, tasks, max_workers=4, retries=3, wait=5, chunksize=CHUNK_SIZE, cache_dir=None):
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(fetch_partition, engine, sql, out_dir, year, retries, wait, chunksize, cache_dir)
+            for out_dir, year, sql in tasks
+        ]
+        results = {}
+        for (out_dir, year, _), future in zip(tasks, futures):
+            try:
+                results[(out_dir, year)] = future.result()
+            except Exception as e:
+                results[(out_dir, year)] = e
+    return results
+
+
+# Method to read a year partitioned dataset back into pandas (optionally only some years/columns)
+def read_partitions(out_dir, years=None, columns=None):
+    filters = [("Year", "in", list(years))] if years is not None else None
+    df = pd.read_parquet(out_dir, columns=columns, filters=filters)
+    if "Year" in df.columns:
+        df["Year"] = df["Year"].astype("int64")
+    return df
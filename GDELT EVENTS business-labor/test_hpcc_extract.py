@@ -0,0 +1,78 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from hpcc_extract import fetch_partitions, read_partitions
+from actor_pairs import BUS_LAB, compile_query, filter_frame, split_directions
+
+YEARS = [1990, 1991]
+CODES = ["BUS", "MNC", "LAB", "GOV", "CVL"]
+
+
+# Method to build synthetic gdelt_events rows: random actor pairs, dates and coordinates
+def synthetic_events(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    year = rng.choice(YEARS, n)
+    df = pd.DataFrame({
+        "GLOBALEVENTID": np.arange(n, dtype="int64"),
+        "SQLDATE": year * 10000 + rng.integers(1, 13, n) * 100 + rng.integers(1, 29, n),
+        "Actor1Code": rng.choice(CODES, n),
+        "Actor2Code": rng.choice(CODES, n),
+        "GoldsteinScale": np.round(rng.uniform(-10, 10, n), 1),
+        "ActionGeo_Lat": rng.uniform(-60, 60, n),
+        "ActionGeo_Long": rng.uniform(-170, 170, n),
+        "Year": year,
+    })
+    df.loc[::97, "ActionGeo_Lat"] = np.nan
+    return df
+
+
+# Method to load the rows into a SQLite stand-in for the HPCC server
+def sqlite_engine(path, df):
+    engine = create_engine(f"sqlite:///{path}")
+    df.to_sql("gdelt_events", engine, index=False)
+    return engine
+
+
+def test_partitioned_extract_and_cache_rerun(tmp_path):
+    events = synthetic_events()
+    engine = sqlite_engine(tmp_path / "gdelt.db", events)
+    out_dir = str(tmp_path / "bus_lab_pairs")
+    cache_dir = str(tmp_path / "cache")
+    tasks = [(out_dir, year, compile_query(BUS_LAB, year)) for year in YEARS]
+
+    # Small chunks so every year is streamed in several row groups
+    results = fetch_partitions(engine, tasks, max_workers=2, chunksize=300, cache_dir=cache_dir)
+    expected = filter_frame(events, BUS_LAB)
+    for year in YEARS:
+        assert results[(out_dir, year)] == (expected["Year"] == year).sum()
+        assert pq.ParquetFile(os.path.join(out_dir, f"Year={year}", "part-0.parquet")).metadata.num_row_groups > 1
+
+    # Store types (see gdelt_store.py)
+    schema = pq.read_schema(os.path.join(out_dir, f"Year={YEARS[0]}", "part-0.parquet"))
+    assert schema.field("SQLDATE").type == pa.int32()
+    assert pa.types.is_dictionary(schema.field("Actor1Code").type)
+    assert pa.types.is_dictionary(schema.field("direction").type)
+    assert schema.field("ActionGeo_Lat").type == pa.float32()
+    assert schema.field("gid").type == pa.int32()
+    assert "Year" not in schema.names
+
+    df = read_partitions(out_dir)
+    assert df["Year"].dtype == "int64"
+    parts = split_directions(df, BUS_LAB)
+    for name, part in split_directions(expected, BUS_LAB).items():
+        assert len(parts[name]) == len(part)
+        assert sorted(parts[name]["GLOBALEVENTID"]) == sorted(part["GLOBALEVENTID"])
+
+    # A rerun is served from the cache: the server table is gone, the result is the same
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE gdelt_events")
+    rerun = fetch_partitions(engine, tasks, max_workers=2, chunksize=300, cache_dir=cache_dir)
+    assert rerun == results
+    assert len(read_partitions(out_dir)) == len(df)
@@ -0,0 +1,315 @@
+import os
+import sys
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from prio_grid import lat_long_to_gid
+from actor_pairs import ALL_ACTORS, filter_frame
+from gdelt_store import iter_events
+
+# Columns of the yearly event CSVs (data/*.csv) used for the Goldstein panels
+EVENT_COLUMNS = ['ActionGeo_Lat', 'Actor1Code', 'Actor2Code', 'GoldsteinScale', 'SQLDATE', 'ActionGeo_Long']
+
+# The same from the events store (see gdelt_store.py), where the cell is already in gid
+STORE_COLUMNS = ['Actor1Code', 'Actor2Code', 'GoldsteinScale', 'SQLDATE', 'gid']
+
+# Actor roles the panels are pivoted on (df_pivot_1 and df_pivot_2)
+ROLES = ['Actor1Code', 'Actor2Code']
+
+# Actor groups combined into composite columns (mean_GoldsteinScale_<group> and
+# count_GoldsteinScale_<group>). The composite mean is weighted by events: the sum over
+# all events of the group's codes divided by their count.
+ACTOR_GROUPS = {
+    'BUS_MNC': ['BUS', 'MNC'],
+    'NGM_NGO': ['NGM', 'NGO'],
+    'COP_JUD_MIL_SPY': ['COP', 'JUD', 'MIL', 'SPY'],
+    'INS_REB_IMG': ['INS', 'REB', 'IMG'],
+    'INT_UIS': ['INT', 'UIS'],
+}
+
+# Names of the mean and count columns of a code or group in the published panels, per role
+# (see panel_names)
+PANEL_NAMES = {
+    'Actor1Code': ('{}_All_Actors_GoldsteinScale', '{}_All_Actors_Count'),
+    'Actor2Code': ('All_Actors_{}_GoldsteinScale_Count', 'All_Actors_{}_Count'),
+}
+
+# Rows of a CSV read at a time
+CHUNKSIZE = 1_000_000
+
+# Daily rollup cube (see build_cube), shared by the daily, monthly and yearly notebooks
+CUBE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'goldstein_cube')
+
+# The partial state of the aggregation is one row per (role, period, gid, actor) with the
+# sum, count and sum of squares of GoldsteinScale. Two states are merged by adding them up,
+# so files / chunks can be aggregated one at a time (or in parallel) and combined at the end.
+STATE_COLUMNS = ['sum', 'count', 'sumsq']
+
+
+# Method to read the event CSVs one chunk at a time, only the columns used. A path can also
+# be the events store or one of its year partitions, read a file at a time.
+def read_chunks(paths, chunksize=CHUNKSIZE, columns=EVENT_COLUMNS):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_events(path, STORE_COLUMNS)
+        else:
+            yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+
+# Method to get the period of every SQLDATE (yyyymmdd ints): pandas Periods of freq
+# ('D', 'M', ...), or the year as an int for freq 'Y' (the year column of the notebooks)
+def period_key(sqldate, freq='M'):
+    d = np.asarray(sqldate, dtype='int64')
+    year, month, day = d // 10000, d // 100 % 100, d % 100
+    if freq == 'Y':
+        return year
+    if freq == 'M':
+        return pd.PeriodIndex.from_ordinals((year - 1970) * 12 + month - 1, freq='M')
+    return pd.PeriodIndex(pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day})), freq=freq)
+
+
+# Method to get the codes of an actor pair spec (see actor_pairs.py), in the order of the spec
+def pair_codes(pairs=ALL_ACTORS):
+    return list(dict.fromkeys(code.upper() for actor1, actor2 in pairs.values() for code in [*actor1, *actor2]))
+
+
+# Method to select the events of a chunk used for the panels. Only the events of the actor
+# pair spec are kept, with actor_pairs.filter_frame (ALL_ACTORS: both actors in ACTOR_CODES,
+# like the notebooks), and events are placed in PRIO GRID cells (only the cells of the spine
+# if spine_gids is given). Chunks of the events store come with their gid, the cell is only
+# worked out from the coordinates for the CSVs.
+# Returns the kept rows with their period, gid and GoldsteinScale.
+def select_events(chunk, freq='M', pairs=ALL_ACTORS, spine_gids=None):
+    chunk = filter_frame(chunk, pairs)
+    if 'gid' in chunk.columns:
+        gid = chunk['gid'].to_numpy(dtype='int64', na_value=-1)
+        valid = gid > 0
+        if spine_gids is not None:
+            valid &= np.isin(gid, np.asarray(spine_gids, dtype='int64'))
+    else:
+        gid, valid = lat_long_to_gid(chunk['ActionGeo_Lat'], chunk['ActionGeo_Long'], spine_gids)
+    chunk = chunk[valid]
+    return chunk, period_key(chunk['SQLDATE'], freq), gid[valid], chunk['GoldsteinScale'].to_numpy(dtype='float64')
+
+
+# Method to aggregate one chunk of events into a partial state. Codes are matched case
+# insensitively by filter_frame, so they are upper cased to the codes of the spec.
+def partial_state(chunk, freq='M', period_col='month_year', pairs=ALL_ACTORS, spine_gids=None):
+    chunk, period, gid, x = select_events(chunk, freq, pairs, spine_gids)
+    actor_codes = pair_codes(pairs)
+
+    parts = []
+    for role in ROLES:
+        part = pd.DataFrame({'role': pd.Categorical([role] * len(chunk), categories=ROLES),
+                             period_col: period, 'gid': gid,
+                             'actor': pd.Categorical(chunk[role].astype(str).str.upper(), categories=actor_codes),
+                             'x': x, 'sq': x * x})
+        parts.append(part.groupby(['role', period_col, 'gid', 'actor'], observed=True)
+                         .agg(sum=('x', 'sum'), count=('x', 'count'), sumsq=('sq', 'sum')))
+    return pd.concat(parts)
+
+
+# Method to merge partial states into one
+def merge_states(states):
+    states = [state for state in states if state is not None]
+    merged = pd.concat(states)
+    return merged.groupby(level=list(merged.index.names), observed=True).sum()
+
+
+# Method to aggregate a stream of event chunks. The partials of the chunks are folded into
+# the running state once they add up to as many rows as the state, so memory stays within
+# about twice the final state plus one chunk, and the folding is linear in the number of rows.
+def aggregate(chunks, freq='M', period_col='month_year', pairs=ALL_ACTORS, spine_gids=None):
+    state, pending, pending_rows = None, [], 0
+    for chunk in chunks:
+        part = partial_state(chunk, freq, period_col, pairs, spine_gids)
+        pending.append(part)
+        pending_rows += len(part)
+        if state is None or pending_rows >= len(state):
+            state = merge_states([state] + pending)
+            pending, pending_rows = [], 0
+    if state is None:
+        return partial_state(pd.DataFrame(columns=EVENT_COLUMNS), freq, period_col, pairs, spine_gids)
+    return merge_states([state] + pending) if pending else state
+
+
+# Method to get the mean, count and standard deviation of GoldsteinScale from a state
+def summarize(state):
+    n = state['count']
+    mean = state['sum'] / n
+    var = (state['sumsq'] - n * mean * mean) / (n - 1)
+    return pd.DataFrame({'mean': mean, 'count': n, 'std': np.sqrt(var.clip(lower=0))})
+
+
+# Method to build the wide table of one role from dense arrays: sums and counts are
+# (rows, actors) arrays for the (period, gid) rows in keys. Gives the columns
+# mean_GoldsteinScale_<code> / count_GoldsteinScale_<code> for every code seen (counts > 0),
+# sorted, then the same for every group of groups with a code seen. Group columns add up the
+# sums and counts of their codes, so the group mean is weighted by events.
+def wide_frame(keys, sums, counts, actors, groups=ACTOR_GROUPS):
+    seen = counts.any(axis=0)
+    order = sorted(np.flatnonzero(seen), key=lambda i: actors[i])
+    labels = [actors[i] for i in order]
+    sum_cols, count_cols = [sums[:, order]], [counts[:, order]]
+    position = {actor: i for i, actor in enumerate(actors)}
+    for name, group in groups.items():
+        cols = [position[code] for code in group if code in position and seen[position[code]]]
+        if cols:
+            labels.append(name)
+            sum_cols.append(sums[:, cols].sum(axis=1, keepdims=True))
+            count_cols.append(counts[:, cols].sum(axis=1, keepdims=True))
+
+    count = np.hstack(count_cols).astype('float64')
+    count[count == 0] = np.nan
+    mean = np.hstack(sum_cols) / count
+    return pd.concat([keys.reset_index(drop=True),
+                      pd.DataFrame(mean, columns=['mean_GoldsteinScale_' + label for label in labels]),
+                      pd.DataFrame(count, columns=['count_GoldsteinScale_' + label for label in labels])], axis=1)
+
+
+# Method to allocate the dense backend for the observed (period, gid) cells in keys: sum, count
+# and sum of squares of GoldsteinScale in arrays of shape (roles, cells, actors), in memory or,
+# with path, as memory-mapped .npy files in that directory. Only the cells with events get a
+# row (the full spine x calendar would be about 34 GB), so the size is known once the cells are:
+# 20 bytes per array entry.
+def new_tensor(keys, actors, path=None):
+    shape = (len(ROLES), len(keys), len(actors))
+    tensor = {'keys': keys.reset_index(drop=True), 'actors': list(actors)}
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+    for name, dtype in (('sum', 'float64'), ('count', 'int64'), ('sumsq', 'float64')):
+        if path is None:
+            tensor[name] = np.zeros(shape, dtype=dtype)
+        else:
+            tensor[name] = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+    return tensor
+
+
+# Method to add rows of partial sums to the dense backend. role, cell and actor are the integer
+# codes of every row (into ROLES, the keys and the actors of the tensor). Every row gets the flat
+# index of its entry; the rows hitting the same entry are added up with bincount, and the arrays
+# are updated once per entry hit.
+def accumulate(tensor, role, cell, actor, sums, counts, sumsqs):
+    flat = np.ravel_multi_index((role, cell, actor), tensor['sum'].shape)
+    entries, inverse = np.unique(flat, return_inverse=True)
+    for name, values in (('sum', sums), ('count', counts), ('sumsq', sumsqs)):
+        added = np.bincount(inverse, weights=np.asarray(values, dtype='float64'), minlength=len(entries))
+        tensor[name].reshape(-1)[entries] += added.astype(tensor[name].dtype)
+    return tensor
+
+
+# Method to turn rows keyed by role, period, gid and actor into integer codes and add them to a
+# new dense backend: the (period, gid) cells are factorized (sorted, like pivot_table's rows)
+# and the actors are the codes seen, sorted.
+def codes_tensor(role, period, gid, actor, values, period_col='month_year', path=None):
+    cell, cells = pd.factorize(pd.MultiIndex.from_arrays([period, gid]), sort=True)
+    actor, actors = pd.factorize(np.asarray(actor, dtype=str), sort=True)
+    role = pd.Categorical(role, categories=ROLES).codes
+    tensor = new_tensor(cells.to_frame(index=False, name=[period_col, 'gid']), actors, path)
+    return accumulate(tensor, role, cell, actor, *[values[name].to_numpy() for name in STATE_COLUMNS])
+
+
+# Method to write a state (see aggregate / rollup) into the dense backend
+def state_tensor(state, period_col='month_year', path=None):
+    index = state.index
+    return codes_tensor(index.get_level_values('role'), index.get_level_values(period_col),
+                        index.get_level_values('gid').to_numpy(dtype='int64'),
+                        index.get_level_values('actor'), state, period_col, path)
+
+
+# Method to roll the cube up into the dense backend, like rollup but without a groupby: the
+# periods and cells of the cube rows are turned into integer codes and the sums, counts and
+# sums of squares added up with bincount. Pass path to keep the arrays memory mapped there.
+def rollup_tensor(cube, freq='M', period_col='month_year', path=None):
+    day = pd.PeriodIndex(cube['day'], freq='D')
+    period = day.year if freq == 'Y' else day.asfreq(freq)
+    return codes_tensor(cube['role'].astype(str), period, cube['gid'].to_numpy(dtype='int64'),
+                        cube['actor'], cube, period_col, path)
+
+
+# Method to pivot one role like the notebooks' pivot_table does: one row per observed
+# (period, gid), sorted, with the columns of wide_frame. Takes the dense backend, or a state
+# which is written into it first (see state_tensor). Only the cells with events of the role are
+# read from the arrays.
+def wide(tensor, role, period_col='month_year', groups=ACTOR_GROUPS):
+    if isinstance(tensor, pd.DataFrame):
+        tensor = state_tensor(tensor, period_col)
+    r = ROLES.index(role)
+    counts = tensor['count'][r]
+    rows = np.flatnonzero(counts.any(axis=1))
+    keys = tensor['keys'].iloc[rows][[period_col, 'gid']]
+    return wide_frame(keys, tensor['sum'][r][rows], counts[rows], tensor['actors'], groups)
+
+
+# Method to give the columns of wide (or of its sparse panel) the names of the published panels:
+# <code>_All_Actors_GoldsteinScale / <code>_All_Actors_Count for Actor1Code and
+# All_Actors_<code>_GoldsteinScale_Count / All_Actors_<code>_Count for Actor2Code (the mean
+# keeps the _Count suffix the old renames gave it). gid and the period come first, then the
+# value columns sorted alphabetically; other columns (e.g. lat / lon of the spine) are dropped.
+def panel_names(panel, role, period_col='month_year'):
+    mean_name, count_name = PANEL_NAMES[role]
+    names = {}
+    for col in panel.columns:
+        if col.startswith('mean_GoldsteinScale_'):
+            names[col] = mean_name.format(col[len('mean_GoldsteinScale_'):])
+        elif col.startswith('count_GoldsteinScale_'):
+            names[col] = count_name.format(col[len('count_GoldsteinScale_'):])
+    return panel.rename(columns=names)[['gid', period_col] + sorted(names.values())]
+
+
+# Method to build the rollup cube: the state at the finest grain (role x day x gid x actor),
+# stored as Parquet partitioned by year with compact types (date32 days, int32 gids and counts,
+# dictionary encoded roles and actors). Every CSV (or year partition of the events store) is
+# aggregated and written on its own; states add up, so a day found in two files is simply
+# merged when the cube is rolled up. Only the events of the actor pair spec pairs are kept.
+# The cube is built next to path and moved there when complete.
+def build_cube(paths, path=CUBE_PATH, chunksize=CHUNKSIZE, pairs=ALL_ACTORS, spine_gids=None):
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for i, source in enumerate(paths):
+        state = aggregate(read_chunks([source], chunksize), 'D', 'day', pairs, spine_gids).reset_index()
+        day = state['day'].dt.to_timestamp()
+        table = pa.table({'role': pa.array(state['role']).cast(pa.dictionary(pa.int8(), pa.string())),
+                          'day': pa.array(day.to_numpy(dtype='datetime64[D]')),
+                          'gid': pa.array(state['gid'].to_numpy(dtype='int32')),
+                          'actor': pa.array(state['actor']).cast(pa.dictionary(pa.int8(), pa.string())),
+                          'sum': pa.array(state['sum'].to_numpy(dtype='float64')),
+                          'count': pa.array(state['count'].to_numpy(dtype='int32')),
+                          'sumsq': pa.array(state['sumsq'].to_numpy(dtype='float64')),
+                          'year': pa.array(day.dt.year.to_numpy(dtype='int32'))})
+        pq.write_to_dataset(table, tmp, partition_cols=['year'], basename_template=f'part-{i:05d}-{{i}}.parquet',
+                            existing_data_behavior='overwrite_or_ignore')
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+# Method to read the cube, only the given years / roles if given
+def read_cube(path=CUBE_PATH, years=None, roles=None):
+    filters = []
+    if years is not None:
+        filters.append(('year', 'in', list(years)))
+    if roles is not None:
+        filters.append(('role', 'in', list(roles)))
+    columns = ['role', 'day', 'gid', 'actor'] + STATE_COLUMNS
+    return pq.read_table(path, columns=columns, filters=filters or None).to_pandas(date_as_object=False)
+
+
+# Method to roll the cube up to another resolution: pandas Periods of freq ('D', 'W', 'M',
+# 'Q', ...) or the year as an int for freq 'Y'. Gives a state like aggregate does, so wide
+# and summarize work on it, without going back to the events.
+def rollup(cube, freq='M', period_col='month_year'):
+    day = pd.PeriodIndex(cube['day'], freq='D')
+    period = day.year if freq == 'Y' else day.asfreq(freq)
+    keys = [cube['role'].rename('role'), pd.Series(period, index=cube.index, name=period_col),
+            cube['gid'].astype('int64').rename('gid'), cube['actor'].rename('actor')]
+    state = cube[STATE_COLUMNS].groupby(keys, observed=True).sum()
+    state['count'] = state['count'].astype('int64')
+    return state
@@ -0,0 +1,81 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from prio_grid import center_to_gid
+
+SPINE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'PRIO GRID spine.csv')
+
+# Years covered by the GDELT EVENTS total panels
+START = '1990-01-01'
+END = '2022-12-31'
+
+
+# Method to read the PRIO GRID spine, the cell dimension of the panels (gid, lat, lon)
+def read_spine(path=SPINE_PATH):
+    return pd.read_csv(path)
+
+
+# Method to build the calendar dimension, one row per period from start to end.
+# Periods are pandas Periods (e.g. freq 'M' for month_year), or plain ints for 'year'.
+def calendar(freq='M', start=START, end=END, period_col='month_year'):
+    periods = pd.period_range(start, end, freq=freq)
+    if period_col == 'year':
+        return pd.DataFrame({'year': periods.year})
+    return pd.DataFrame({period_col: periods})
+
+
+# Method to turn a pivot keyed by (period, pg_lat, pg_long) or (period, gid) into a sparse
+# panel: only the observed (cell, period) rows, keyed by gid and with the spine columns of the
+# cell. Cells missing from the spine are dropped, like the old left merge onto base_df did.
+# Columns come out as the merge onto base_df gave them: period, spine columns, values.
+def sparse_panel(pivot, spine, period_col='month_year'):
+    if 'gid' in pivot.columns:
+        gid = pivot['gid'].to_numpy(dtype='int64')
+        valid = np.isin(gid, spine['gid'].to_numpy())
+        keys = ['gid', period_col]
+    else:
+        gid, valid = center_to_gid(pivot['pg_lat'], pivot['pg_long'], spine['gid'])
+        keys = ['pg_lat', 'pg_long', period_col]
+    values = pivot.loc[valid].drop(columns=keys).reset_index(drop=True)
+    keys = pd.DataFrame({period_col: pivot.loc[valid, period_col].to_numpy(), 'gid': gid[valid]})
+    keys = keys.merge(spine, on='gid', how='left')
+    return pd.concat([keys, values], axis=1)
+
+
+# Method to expand a sparse panel to the full spine x calendar panel (what the cross join
+# base_df used to give), one period at a time so a consumer can write every period out
+# without holding the whole panel. Pass a part of the spine / calendar to densify only that.
+def densify(panel, spine, periods, period_col='month_year'):
+    spine_cols = [col for col in spine.columns if col != 'gid']
+    values = panel.drop(columns=[col for col in spine_cols if col in panel.columns])
+    parts = dict(tuple(values.groupby(period_col, sort=False)))
+    empty = values.iloc[:0]
+    for period in periods:
+        base = spine.copy()
+        base.insert(0, period_col, pd.Series([period] * len(base), dtype=values[period_col].dtype))
+        yield base.merge(parts.get(period, empty), on=['gid', period_col], how='left')
+
+
+# Method to write a panel as Parquet partitioned by year (<path>/year=<year>/...).
+# Writing a year again replaces its files.
+def write_panel(panel, path, period_col='month_year'):
+    if period_col != 'year':
+        panel = panel.assign(year=panel[period_col].dt.year)
+    table = pa.Table.from_pandas(panel, preserve_index=False)
+    pq.write_to_dataset(table, path, partition_cols=['year'], existing_data_behavior='delete_matching')
+
+
+# Method to read a panel written by write_panel, only the given years / columns if given
+def read_panel(path, years=None, columns=None, period_col='month_year'):
+    filters = [('year', 'in', list(years))] if years is not None else None
+    panel = pq.read_table(path, columns=columns, filters=filters).to_pandas()
+    if period_col != 'year':
+        return panel.drop(columns='year', errors='ignore')
+    panel['year'] = panel['year'].astype('int64')
+    return panel
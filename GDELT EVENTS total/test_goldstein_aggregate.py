@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from actor_pairs import BUS_LAB, filter_frame
+from goldstein_aggregate import ROLES, build_cube, read_cube, rollup, rollup_tensor, summarize, wide
+
+CODES = ["BUS", "MNC", "LAB", "GOV", "COP", "REB", "XXX"]
+
+
+# Method to write synthetic yearly event CSVs: random actors, days and coordinates, with some
+# GoldsteinScale values of exactly 0 so real 0.0 means show up in the panels
+def synthetic_csvs(tmp_path, n=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for year in [1990, 1991]:
+        df = pd.DataFrame({
+            "SQLDATE": year * 10000 + rng.integers(1, 13, n) * 100 + rng.integers(1, 29, n),
+            "Actor1Code": rng.choice(CODES, n),
+            "Actor2Code": rng.choice(CODES, n),
+            "GoldsteinScale": np.round(rng.uniform(-10, 10, n), 1) * rng.integers(0, 2, n),
+            "ActionGeo_Lat": rng.uniform(-2, 2, n),
+            "ActionGeo_Long": rng.uniform(30, 34, n),
+        })
+        paths.append(str(tmp_path / f"events_{year}.csv"))
+        df.to_csv(paths[-1], index=False)
+    return paths
+
+
+@pytest.mark.parametrize("freq, period_col", [("D", "day"), ("M", "month_year"), ("Y", "year")])
+def test_rollup_tensor_matches_state(tmp_path, freq, period_col):
+    build_cube(synthetic_csvs(tmp_path), str(tmp_path / "cube"))
+    cube = read_cube(str(tmp_path / "cube"))
+    state = rollup(cube, freq, period_col)
+
+    # In memory and memory mapped, the dense backend gives the means and counts of the state
+    for path in [None, str(tmp_path / "tensor")]:
+        tensor = rollup_tensor(cube, freq, period_col, path)
+        assert tensor["sum"].shape == (len(ROLES), len(tensor["keys"]), 6)
+        for role in ROLES:
+            table = wide(tensor, role, period_col).set_index([period_col, "gid"])
+            expected = summarize(state.xs(role, level="role")).unstack("actor")
+            expected.columns = [f"{stat}_GoldsteinScale_{actor}" for stat, actor in expected.columns]
+            expected = expected.reindex(table.index)
+            for col in expected.columns:
+                if not col.startswith("std_"):
+                    pd.testing.assert_series_equal(table[col], expected[col], check_dtype=False, check_names=False)
+            pd.testing.assert_frame_equal(wide(state, role, period_col).set_index([period_col, "gid"]), table)
+
+    # Real 0.0 means are kept, cells without events of a code are NaN (never a count of 0), and
+    # the BUS_MNC group adds up the events of BUS and MNC
+    assert (table.filter(like="mean_GoldsteinScale_") == 0).any().any()
+    counts = table.filter(like="count_GoldsteinScale_")
+    assert not (counts == 0).any().any()
+    both = counts[["count_GoldsteinScale_BUS", "count_GoldsteinScale_MNC"]].sum(axis=1, min_count=1)
+    pd.testing.assert_series_equal(both, counts["count_GoldsteinScale_BUS_MNC"], check_names=False)
+
+
+def test_cube_keeps_the_events_of_the_pair_spec(tmp_path):
+    paths = synthetic_csvs(tmp_path)
+    build_cube(paths, str(tmp_path / "cube"), pairs=BUS_LAB)
+    cube = read_cube(str(tmp_path / "cube"))
+
+    # Every event kept by filter_frame is counted once per role, in its cell
+    events = pd.concat([pd.read_csv(path) for path in paths])
+    expected = filter_frame(events, BUS_LAB)
+    for role in ROLES:
+        counts = cube[cube["role"] == role].groupby("actor", observed=True)["count"].sum()
+        assert counts.to_dict() == expected[role].value_counts().to_dict()
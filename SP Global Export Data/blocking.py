@@ -0,0 +1,116 @@
+# Candidate generation (blocking) for the Orbis x GDelt matcher.
+#
+# Instead of cross joining every Orbis name with every GDelt name, both lists are turned
+# into sets of character n-grams and only the pairs that share enough n-grams are sent to
+# the fuzz / jellyfish scorers. A pair is a candidate when the shared n-grams cover at
+# least min_overlap of the smaller set (overlap coefficient).
+#
+# The pairs are found with prefix filtering: every name is probed with its prefix, its
+# rarest n-grams, against all n-grams of the other side. If a pair reaches min_overlap,
+# the smaller name shares at least one n-gram of its prefix, whatever the order of the
+# n-grams, so no pair is lost. The order only keeps the probes cheap: rare n-grams have
+# short postings lists.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+# Method to get the n-gram vectorizer. N-grams of each word are padded with spaces, so
+# short words still produce n-grams. With vocabulary, the vectorizer is ready without fitting.
+def ngram_vectorizer(n=3, vocabulary=None):
+    return CountVectorizer(analyzer='char_wb', ngram_range=(n, n), binary=True, lowercase=False, dtype=np.int32,
+                           vocabulary=vocabulary)
+
+
+# Method to get the binary name x n-gram matrices of left and right over a shared vocabulary,
+# and the vocabulary (n-gram of every column)
+def ngram_matrices(left, right, n=3):
+    vectorizer = ngram_vectorizer(n)
+    vectorizer.fit(pd.concat([pd.Series(left), pd.Series(right)]).astype('U'))
+    A = vectorizer.transform(pd.Series(left).astype('U')).tocsr()
+    B = vectorizer.transform(pd.Series(right).astype('U')).tocsr()
+    return A, B, vectorizer.get_feature_names_out()
+
+
+# Method to count the names every n-gram appears in (document frequency), as a Series indexed
+# by n-gram. When candidate_pairs runs on parts of an input, count once over the whole input
+# and pass it to every part, so all parts order the n-grams the same way.
+def ngram_doc_freq(names, n=3):
+    vectorizer = ngram_vectorizer(n)
+    counts = vectorizer.fit_transform(pd.Series(names).astype('U'))
+    return pd.Series(np.asarray(counts.sum(axis=0)).ravel(), index=vectorizer.get_feature_names_out())
+
+
+# Method to rank n-grams by their document frequencies, rarest first (ties in column order)
+def ngram_rank(freq):
+    rank = np.empty(len(freq), dtype='int64')
+    rank[np.argsort(freq, kind='stable')] = np.arange(len(freq))
+    return rank
+
+
+# Method to fit the blocking once for the parts of a bigger input: a vectorizer over the n-grams
+# of doc_freq (see ngram_doc_freq, counted over the whole input) and the rank of every n-gram.
+# Passed to candidate_pairs as blocker, the parts are blocked without fitting a vectorizer or
+# ranking the n-grams again, with the same pairs as with doc_freq.
+def fit_blocker(doc_freq, n=3):
+    doc_freq = pd.Series(doc_freq).sort_index()
+    return ngram_vectorizer(n, doc_freq.index.tolist()), ngram_rank(doc_freq.to_numpy())
+
+
+# Method to keep the prefix of every row of a binary matrix: its n-grams in the order of rank
+# (rarest first), as many as needed so that a name sharing at least min_overlap of the row's
+# n-grams shares one of them (size - ceil(min_overlap * size) + 1).
+def prefix_matrix(M, rank, min_overlap):
+    sizes = np.diff(M.indptr)
+    prefix = sizes - np.ceil(min_overlap * sizes).astype('int64') + 1
+    row = np.repeat(np.arange(M.shape[0]), sizes)
+    order = np.lexsort((rank[M.indices], row))
+    keep = np.arange(len(order)) - M.indptr[row] < prefix[row]
+    data = np.ones(int(keep.sum()), dtype=np.int32)
+    return sparse.csr_matrix((data, (row[keep], M.indices[order][keep])), shape=M.shape)
+
+
+# Method to find the plausible pairs of left x right. Returns their positions: 'left' (row of
+# left), 'right' (row of right) and 'shared' (number of shared n-grams). A pair is kept when the
+# shared n-grams cover at least min_overlap of the smaller name, which is well below what the
+# default match threshold (total_score_name > 280 and jaro_distance > 0.9) needs.
+# doc_freq (see ngram_doc_freq) orders the n-grams of the prefixes, by default it is counted
+# over left and right. blocker (see fit_blocker) gives the vectorizer and the order instead.
+def candidate_pairs(left, right, n=3, min_overlap=0.5, doc_freq=None, blocker=None):
+    if blocker is not None:
+        vectorizer, rank = blocker
+        A = vectorizer.transform(pd.Series(left).astype('U')).tocsr()
+        B = vectorizer.transform(pd.Series(right).astype('U')).tocsr()
+    else:
+        A, B, vocabulary = ngram_matrices(left, right, n)
+        if doc_freq is None:
+            freq = np.asarray(A.sum(axis=0)).ravel() + np.asarray(B.sum(axis=0)).ravel()
+        else:
+            freq = pd.Series(doc_freq).reindex(vocabulary, fill_value=0).to_numpy()
+        rank = ngram_rank(freq)
+
+    # Pairs where a prefix of either side meets the other side, then their overlap in full
+    probe = (prefix_matrix(A, rank, min_overlap) @ B.T + A @ prefix_matrix(B, rank, min_overlap).T).tocoo()
+    rows, cols = probe.row, probe.col
+    shared = np.asarray(A[rows].multiply(B[cols]).sum(axis=1)).ravel()
+
+    smaller = np.minimum(np.diff(A.indptr)[rows], np.diff(B.indptr)[cols])
+    keep = (shared > 0) & (shared >= min_overlap * smaller)
+    pairs = pd.DataFrame({'left': rows[keep], 'right': cols[keep], 'shared': shared[keep]})
+    return pairs.sort_values(['left', 'right']).reset_index(drop=True)
+
+
+# Method to build the pair frame of the candidate pairs. Same layout as the old key=1 cross
+# join (GDelt columns first, '_x'/'_y' suffixes), but only for the candidate pairs.
+def candidate_frame(orbis, gdelt, orbis_col='name_clean', gdelt_col='name_gdelt', **kwargs):
+    pairs = candidate_pairs(orbis[orbis_col], gdelt[gdelt_col], **kwargs)
+    return pair_frame(orbis, gdelt, pairs['left'], pairs['right'])
+
+
+# Method to put GDelt row right[i] next to Orbis row left[i] (positions), for every i
+def pair_frame(orbis, gdelt, left, right):
+    return pd.merge(gdelt.iloc[right].reset_index(drop=True),
+                    orbis.iloc[left].reset_index(drop=True),
+                    left_index=True, right_index=True)
@@ -83,6 +83,12 @@ indata_orbis = indata_orbis[['Company name Latin alphabet']].dropna()
 # In[ ]:
 
 
+indata_orbis['Company name Latin alphabet'].apply(str.lower)
+
+
+# In[ ]:
+
+
 indata_orbis['name_original'] = indata_orbis['Company name Latin alphabet']
 indata_orbis['name'] = pd.DataFrame(indata_orbis['Company name Latin alphabet'].apply(str.lower))
 outdata_orbis = indata_orbis[['name_original', 'name']]
@@ -92,40 +98,26 @@ outdata_orbis.sort_values(by='name', inplace=True)
 # #### Clean company names
 # 
 # We need to clean company names to get rid of odd artifacts and other wrinkles. Remove anything in parenthesis, all punctuation, and any extra whitespaces.
+# 
+# The "cleanco" package removes company suffixes such as "inc." and "limited".
+# 
+# Cleaning is done by the name feature store (`name_features.py`): every distinct name is cleaned once, together with its metaphones, token set and n-gram signature, and stored in `./output/name_features` keyed by the raw name. Names seen in earlier runs are not cleaned again. Each name gets an integer `name_id` that the scoring step uses to look up its features.
 
 # In[ ]:
 
 
-import string
-
-# Helper methods for name cleaning.
-
-def remove_parenthesis(name):
-    import regex as re
-    return re.sub(r'\(.*\)', '', name)
-
-def remove_punctuation(name):
-    return name.translate(str.maketrans('', '', string.punctuation))
-
-def remove_double_space(name):
-    name = ' '.join(name.split())
-    return name
+get_ipython().system('pip install cleanco')
+from name_features import lookup
 
+name_ids, name_features = lookup(outdata_orbis['name_original'])
+outdata_orbis['name_id'] = name_ids
+outdata_orbis['name_clean'] = name_features['name_clean'].to_numpy()[name_ids]
 
-# The "cleanco" package removes company suffixes such as "inc." and "limited".
 
 # In[ ]:
 
 
-get_ipython().system('pip install cleanco')
-from cleanco import basename
-
-outdata_orbis['name_clean'] = outdata_orbis['name'].apply(str.strip)
-outdata_orbis['name_clean'] = outdata_orbis['name_clean'].apply(remove_parenthesis)
-outdata_orbis['name_clean'] = outdata_orbis['name_clean'].apply(remove_punctuation)
-outdata_orbis['name_clean'] = outdata_orbis['name_clean'].apply(basename)
-outdata_orbis['name_clean'] = outdata_orbis['name_clean'].apply(basename) # run basename() twice because of multiple suffixes
-outdata_orbis['name_clean'] = outdata_orbis['name_clean'].apply(remove_double_space)
+indata_orbis.head()
 
 
 # In[ ]:
@@ -153,56 +145,44 @@ indata_gdelt = pd.read_csv(GDELT_INPUT)
 # In[ ]:
 
 
-len(indata_gdelt)
+indata_gdelt.head()
 
 
 # In[ ]:
 
 
-indata_gdelt = indata_gdelt[['organizations']].dropna()
+len(indata_gdelt)
 
 
 # In[ ]:
 
 
-orgs_unextracted_gdelt = []
-
-for index, row in indata_gdelt.iterrows():
-    # row is a single-item list with a string surrounded
-    # by curly braces. Extract the single item and remove
-    # the surrounding curly braces.
-    orgs_unextracted_gdelt.append(row[0][1:-1])
+indata_gdelt = indata_gdelt[['organizations']].dropna()
 
 
 # In[ ]:
 
 
-import regex as re
-orgs_extracted_gdelt = []
+from gkg_parser import parse_organizations, organization_counts
 
 # The rows are json-like formatted strings that contain non-quoted
 # information which includes company names, each of which can be extracted 
-# via regex and be treated as a subrow.
-for row in orgs_unextracted_gdelt:
-    row = row.split('},')
-    for subrow in row:
-        match = re.findall(r'(?:n=)(.*)(?:,)', subrow)
-        orgs_extracted_gdelt.append(match[0])
+# via regex and be treated as a subrow. All rows are parsed in one vectorized
+# pass (see gkg_parser.py): one row per mention with its article and offset.
+orgs_extracted_gdelt = parse_organizations(indata_gdelt['organizations'])
 
 
 # In[ ]:
 
 
-orgs_extracted_gdelt = pd.DataFrame(orgs_extracted_gdelt)
+# Number of mentions of every organization, most mentioned first.
+outdata_gdelt = organization_counts(orgs_extracted_gdelt)
 
 
 # In[ ]:
 
 
-outdata_gdelt = pd.DataFrame(orgs_extracted_gdelt.value_counts())
-outdata_gdelt.rename(columns={0: 'freq_gdelt'}, inplace=True)
-outdata_gdelt.reset_index(inplace=True)
-outdata_gdelt.rename(columns={0: 'name_gdelt'}, inplace=True)
+orgs_extracted_gdelt.head()
 
 
 # In[ ]:
@@ -214,6 +194,12 @@ outdata_gdelt = outdata_gdelt[NUM_ROWS_GDELT_START:NUM_ROWS_GDELT_END]
 # In[ ]:
 
 
+outdata_gdelt.head()
+
+
+# In[ ]:
+
+
 len(outdata_gdelt)
 
 
@@ -221,13 +207,9 @@ len(outdata_gdelt)
 
 
 outdata_gdelt['name_original'] = outdata_gdelt['name_gdelt']
-outdata_gdelt['name_gdelt'] = pd.DataFrame(outdata_gdelt['name_gdelt'].apply(str.lower))
-outdata_gdelt['name_gdelt'] = outdata_gdelt['name_gdelt'].apply(str.strip)
-outdata_gdelt['name_gdelt'] = outdata_gdelt['name_gdelt'].apply(remove_parenthesis)
-outdata_gdelt['name_gdelt'] = outdata_gdelt['name_gdelt'].apply(remove_punctuation)
-outdata_gdelt['name_gdelt'] = outdata_gdelt['name_gdelt'].apply(basename)
-outdata_gdelt['name_gdelt'] = outdata_gdelt['name_gdelt'].apply(basename) # run basename() twice because of multiple suffixes
-outdata_gdelt['name_gdelt'] = outdata_gdelt['name_gdelt'].apply(remove_double_space)
+name_ids, name_features = lookup(outdata_gdelt['name_original'])
+outdata_gdelt['name_id'] = name_ids
+outdata_gdelt['name_gdelt'] = name_features['name_clean'].to_numpy()[name_ids]
 
 
 # In[ ]:
@@ -267,162 +249,111 @@ outdata_gdelt.to_csv('./output/gdelt_list.csv')
 
 # # Scoring
 # 
-# Several scoring methods are implemented below, including those from py_stringsimjoin, py_stringmatching, FuzzyWuzzy, and Jellyfish.
+# Several scoring methods are implemented below, including set and edit distance similarities (the measures of py_stringsimjoin / py_stringmatching), FuzzyWuzzy, and Jellyfish.
 
-# ### py_stringsimjoin
-# 
-# Given two tables A and B, this package provides commands to perform string similarity joins between two columns of these tables, such as A.name and B.name, or A.city and B.city.
-# 
-# http://anhaidgroup.github.io/py_stringsimjoin/v0.1.x/overview.html
-
-# In[ ]:
-
-
-get_ipython().system('pip install py_stringsimjoin')
-
-import py_stringsimjoin as ssj
-
-
-# In[ ]:
-
-
-outdata_orbis.reset_index(inplace=True)
-outdata_gdelt.reset_index(inplace=True)
-
-
-# #### Distance join
+# #### Master list
 # 
-# Join two tables using edit distance measure.
+# We pair the dataframe of Orbis organization names with the dataframe of GDelt organization names. Instead of a full cross join (every Orbis name against every GDelt mention), a blocking step first looks up, in a character n-gram index, the GDelt names that share enough n-grams with each Orbis name. Only those candidate pairs are scored, so the number of pairs grows roughly with the input size instead of with the product of both lists. See `blocking.py`; set `BLOCKING_MIN_OVERLAP = 0` to compare every pair like before.
 
 # In[ ]:
 
 
-output_pairs_distance_join = ssj.edit_distance_join(outdata_orbis, outdata_gdelt,
-                                      'index', 'index', 
-                                      'name_clean', 'name_gdelt', 
-                                      50,
-                                      l_out_attrs=['name_clean'], 
-                                      r_out_attrs=['name_gdelt'])
-
+from blocking import candidate_frame
+from topk import MASTER_COLUMNS
 
-# #### py_stringmatching
-
-# In[ ]:
+# Share of the shorter name's character 3-grams that a pair must have in common to be scored.
+BLOCKING_MIN_OVERLAP = 0.5
 
+# Streaming match mode: keep only the best STREAM_TOP_K GDelt candidates of every Orbis name
+# while the pairs are scored in chunks (see "Streaming top-k" below). None builds and scores
+# the full master list and saves master_list.csv and matches_raw.csv like before.
+STREAM_TOP_K = 100
 
-get_ipython().system('pip install py_stringmatching')
+if not STREAM_TOP_K:
+    if BLOCKING_MIN_OVERLAP > 0:
+        master_list = candidate_frame(outdata_orbis, outdata_gdelt, min_overlap=BLOCKING_MIN_OVERLAP)
+    else:
+        # To cross join, merge on a temporary key and then drop it.
+        outdata_gdelt['key'] = 1
+        outdata_orbis['key'] = 1
+        master_list = pd.merge(outdata_gdelt, outdata_orbis, on='key').drop('key', 1)
 
-import py_stringmatching as sm
+    master_list.rename(columns=MASTER_COLUMNS, inplace=True)
 
-ws = sm.WhitespaceTokenizer(return_set=True)
-
-
-# #### Jaccard join
-# 
-# Join two tables using Jaccard similarity measure.
 
 # In[ ]:
 
 
-output_pairs_jaccard_join = ssj.jaccard_join(outdata_orbis, outdata_gdelt, 
-                                             'index', 'index', 
-                                             'name_clean', 'name_gdelt', 
-                                             ws, 0.1, 
-                                             l_out_attrs=['name_clean'], 
-                                             r_out_attrs=['name_gdelt'])
+if not STREAM_TOP_K:
+    display(master_list.head(5))
 
 
-# #### Cosine join
-# 
-# Join two tables using a variant of cosine similarity known as Ochiai coefficient.
-
 # In[ ]:
 
 
-output_pairs_cosine_join = ssj.cosine_join(outdata_orbis, outdata_gdelt, 
-                                             'index', 'index', 
-                                             'name_clean', 'name_gdelt', 
-                                             ws, 0.1, 
-                                             l_out_attrs=['name_clean'], 
-                                             r_out_attrs=['name_gdelt'])
-
+if not STREAM_TOP_K:
+    master_list.to_csv('./output/master_list.csv')
 
-# #### Dice join
-# 
-# Join two tables using Dice similarity measure.
 
 # In[ ]:
 
 
-output_pairs_dice_join = ssj.dice_join(outdata_orbis, outdata_gdelt, 
-                                             'index', 'index', 
-                                             'name_clean', 'name_gdelt', 
-                                             ws, 0.1, 
-                                             l_out_attrs=['name_clean'], 
-                                             r_out_attrs=['name_gdelt'])
-
-
-# #### Overlap join
-# 
-# Join two tables using overlap measure.
-
-# In[ ]:
-
-
-output_pairs_overlap_join = ssj.overlap_join(outdata_orbis, outdata_gdelt, 
-                                             'index', 'index', 
-                                             'name_clean', 'name_gdelt', 
-                                             ws, 0.1, 
-                                             l_out_attrs=['name_clean'], 
-                                             r_out_attrs=['name_gdelt'])
+# Import module for data manipulation
+import pandas as pd
+# Import module for linear algebra
+import numpy as np
+# Import module for Fuzzy string matching
+from fuzzywuzzy import fuzz, process
+# Import module for regex
+import re
+# Import module for iteration
+import itertools
+# Import module for function development
+from typing import Union, List, Tuple
+# Import module for TF-IDF
+from sklearn.feature_extraction.text import TfidfVectorizer
+# Import module for cosine similarity
+from sklearn.metrics.pairwise import cosine_similarity
+# Import module for KNN
+from sklearn.neighbors import NearestNeighbors
 
 
-# #### Overlap coefficient join
-# 
-# Join two tables using overlap coefficient.
-
 # In[ ]:
 
 
-output_pairs_overlap_coefficient_join = ssj.overlap_coefficient_join(outdata_orbis, outdata_gdelt, 
-                                             'index', 'index', 
-                                             'name_clean', 'name_gdelt', 
-                                             ws, 0.1, 
-                                             l_out_attrs=['name_clean'], 
-                                             r_out_attrs=['name_gdelt'])
-
-
-# #### Master list
-# 
-# We take the dataframe of Orbis organization names and cross-join it with the dataframe of GDelt organization names, so that every Orbis company name has a record associating it with every GDelt organization mention. For example, if there are 2 Orbis company names and 3 GDelt article mentions, then there will be six comparisons: 3 comparisons for each of the two Orbis company names.
-
-# In[ ]:
-
+# String matching - TF-IDF
+def build_vectorizer(
+    clean: pd.Series,
+    analyzer: str = 'char', 
+    ngram_range: Tuple[int, int] = (1, 4), 
+    n_neighbors: int = 1, 
+    **kwargs
+    ) -> Tuple:
+    # Create vectorizer
+    vectorizer = TfidfVectorizer(analyzer = analyzer, ngram_range = ngram_range, **kwargs)
+    X = vectorizer.fit_transform(clean.values.astype('U'))
 
-# To cross join, merge on a temporary key and then drop it.
-outdata_gdelt['key'] = 1
-outdata_orbis['key'] = 1
+    # Fit nearest neighbors corpus
+    nbrs = NearestNeighbors(n_neighbors = n_neighbors, metric = 'cosine').fit(X)
+    return vectorizer, nbrs
 
-master_list = pd.merge(outdata_gdelt, outdata_orbis, on='key').drop('key', 1)
-master_list.rename(columns={'name_x': 'name_gdelt', 
-                             'name_original_x': 'name_original_gdelt', 
-                             'name': 'name_orbis', 
-                             'name_clean': 'name_clean_orbis', 
-                             'name_original_y': 'name_original_orbis'}, 
-                    inplace=True)
+# String matching - KNN
+def tfidf_nn(
+    messy, 
+    clean, 
+    n_neighbors = 1, 
+    **kwargs
+    ):
+    # Fit clean data and transform messy data
+    vectorizer, nbrs = build_vectorizer(clean, n_neighbors = n_neighbors, **kwargs)
+    input_vec = vectorizer.transform(messy)
 
 
 # In[ ]:
 
 
-master_list.head(5)
 
 
-# In[ ]:
-
-
-master_list.to_csv('./output/master_list.csv')
-
 
 # #### FuzzyWuzzy and Jellyfish
 # 
@@ -434,28 +365,38 @@ master_list.to_csv('./output/master_list.csv')
 
 
 get_ipython().system('pip install fuzzywuzzy')
+get_ipython().system('pip install python-Levenshtein')
 get_ipython().system('pip install jellyfish')
+get_ipython().system('pip install rapidfuzz')
 
 import pandas as pd
 from fuzzywuzzy import fuzz
 import jellyfish
+from scoring import score_candidates
+from name_features import load_features
+
+# True gives exactly the FuzzyWuzzy/Jellyfish scores, but partial ratio and jaro are then
+# computed one pair at a time. False uses rapidfuzz for every measure, which is faster but
+# its partial ratio can be higher (see scoring.py).
+EXACT_SCORES = True
 
 
 # In[ ]:
 
 
-try:
-    data = master_list
-except:
-    data = pd.read_csv('./output/master_list.csv')
-    data.drop(columns='Unnamed: 0', inplace=True)
+if not STREAM_TOP_K:
+    try:
+        data = master_list
+    except:
+        data = pd.read_csv('./output/master_list.csv')
+        data.drop(columns='Unnamed: 0', inplace=True)
 
-data = data.dropna() # To prevent errors processing matches.
+    data = data.dropna() # To prevent errors processing matches.
 
 
 # #### Calculate fuzz ratios and jaro-wrinkler distances.
 # 
-# This cell calculates fuzz ratios and jaro-wrinkler distances for both spelled-out organization names and their phonetic metaphone variants. A progress bar is included to track execution of large datasets.
+# This cell calculates fuzz ratios and jaro-wrinkler distances for both spelled-out organization names and their phonetic metaphone variants. The scores are computed in batches on all cores (see `scoring.py`) from the per-name features, looked up by name id.
 
 # In[ ]:
 
@@ -463,141 +404,74 @@ data = data.dropna() # To prevent errors processing matches.
 # Get matches of names as well as meta information.
 # This is where the heavy lifting happens.
 
-display('Match processing will take some time...')
-display(str(len(data)) + ' rows...')
-
-get_ipython().system('pip install tqdm')
-from tqdm import tqdm
-tqdm.pandas() # Introduces pd.apply_progress() for progress bars.
-
-# Name comparisons. Run an apply() on two columns.
-display('Calculating fuzz ratio for names...')
-data['fuzz_ratio'] = data.progress_apply(lambda x: fuzz.ratio(x.name_gdelt, x.name_clean_orbis), axis=1)
-display('Calculating fuzz partial ratio for names...')
-data['fuzz_partial_ratio'] = data.progress_apply(lambda x: fuzz.partial_ratio(x.name_gdelt, x.name_clean_orbis), axis=1)
-display('Calculating token sort ratio for names...')
-data['fuzz_token_sort_ratio'] = data.progress_apply(lambda x: fuzz.token_sort_ratio(x.name_gdelt, x.name_clean_orbis), axis=1)
-display('Calculating jaro distance for names...')
-data['jaro_distance'] = data.progress_apply(lambda x: jellyfish.jaro_distance(x.name_gdelt, x.name_clean_orbis), axis=1)
-
-# Metaphone generation.
-display('Generating metaphones for uncleaned orbis names...')
-data['metaphone_unclean_orbis'] = data['name_orbis'].progress_apply(jellyfish.metaphone)
-display('Generating metaphones for cleaned orbis names...')
-data['metaphone_clean_orbis'] = data['name_clean_orbis'].progress_apply(jellyfish.metaphone)
-display('Generating metaphones for gdelt names...')
-data['metaphone_gdelt'] = data['name_gdelt'].progress_apply(jellyfish.metaphone)
-
-# Metaphone comparisons. Run an apply() on two columns.
-display('Calculating fuzz ratio for metaphones...')
-data['metaphone_fuzz_ratio'] = data.progress_apply(lambda x: fuzz.ratio(x.metaphone_gdelt, x.metaphone_clean_orbis), axis=1)
-display('Calculating fuzz partial ratio for metaphones...')
-data['metaphone_fuzz_partial_ratio'] = data.progress_apply(lambda x: fuzz.partial_ratio(x.metaphone_gdelt, x.metaphone_clean_orbis), axis=1)
-display('Calculating token sort ratio for metaphones...')
-data['metaphone_fuzz_token_sort_ratio'] = data.progress_apply(lambda x: fuzz.token_sort_ratio(x.metaphone_gdelt, x.metaphone_clean_orbis), axis=1)
-display('Calculating jaro distance for metaphones...')
-data['metaphone_jaro_distance'] = data.progress_apply(lambda x: jellyfish.jaro_distance(x.metaphone_gdelt, x.metaphone_clean_orbis), axis=1)
+# Features of every name, by name id (cleaned name, metaphones, token sort keys).
+name_features = load_features()
 
-display('Done.')
+if not STREAM_TOP_K:
+    display('Match processing will take some time...')
+    display(str(len(data)) + ' rows...')
 
+    # Name and metaphone comparisons. The scores are computed in batched passes over worker processes.
+    display('Calculating fuzz ratios and jaro distance for names and metaphones...')
+    data = score_candidates(data, name_features, exact=EXACT_SCORES)
 
-# In[ ]:
-
+    display('Done.')
 
-data.sample(5)
-
-
-# #### py_stringsimjoin
-# 
-# Edit distance join
 
 # In[ ]:
 
 
-data = pd.merge(data, 
-                output_pairs_distance_join, 
-                how='outer', 
-                left_on=['index_x', 'index_y'], 
-                right_on=['r_index', 'l_index'])
-
-data.rename(columns={'_sim_score': 'sim_score_distance'}, inplace=True)
+if not STREAM_TOP_K:
+    display(data.sample(5))
 
 
-# #### py_stringmatching
+# #### Similarity joins
 # 
-# Jaccard join
-
-# In[ ]:
-
-
-data = pd.merge(data, 
-                output_pairs_jaccard_join, 
-                how='outer', 
-                left_on=['index_x', 'index_y'], 
-                right_on=['r_index', 'l_index'])
-
-data.rename(columns={'_sim_score': 'sim_score_jaccard'}, inplace=True)
-
-
-# Cosine join
+# Edit distance, Jaccard, cosine (Ochiai coefficient), Dice, overlap and overlap coefficient scores of the cleaned names, as the py_stringsimjoin joins gave them (whitespace token sets, threshold 0.1; edit distance up to 50). All six measures are computed in one pass over the pair table: every name is tokenized once by name id and the scores are written straight into `data` instead of running six joins and merging their outputs back (see `simjoin.py`). A score is empty when the pair is below that measure's threshold.
 
 # In[ ]:
 
 
-data = pd.merge(data, 
-                output_pairs_cosine_join, 
-                how='outer', 
-                left_on=['index_x', 'index_y'], 
-                right_on=['r_index', 'l_index'])
+from simjoin import add_similarity_scores
 
-data.rename(columns={'_sim_score': 'sim_score_cosine'}, inplace=True)
+SIM_THRESHOLDS = {'set_threshold': 0.1, 'distance_threshold': 50}
 
+if not STREAM_TOP_K:
+    data = add_similarity_scores(data, 'name_id_orbis', 'name_id_gdelt', name_features['name_clean'], **SIM_THRESHOLDS)
 
-# Dice join
 
-# In[ ]:
-
-
-data = pd.merge(data, 
-                output_pairs_dice_join, 
-                how='outer', 
-                left_on=['index_x', 'index_y'], 
-                right_on=['r_index', 'l_index'])
-
-data.rename(columns={'_sim_score': 'sim_score_dice'}, inplace=True)
-
-
-# Overlap join
+# #### Streaming top-k
+# 
+# With `STREAM_TOP_K` set, the cells above are skipped. The candidate pairs (or, with `BLOCKING_MIN_OVERLAP = 0`, the cross join) are built, scored and ranked a chunk at a time, and only the best `STREAM_TOP_K` GDelt candidates of every Orbis name (ranked by fuzz ratio, partial ratio and token sort ratio, like the sorting below) are kept. Memory grows with the number of Orbis names instead of the number of pairs. The survivors are saved to `./output/matches_topk.parquet` instead of `master_list.csv` and `matches_raw.csv` (see `topk.py`).
 
 # In[ ]:
 
 
-data = pd.merge(data, output_pairs_overlap_join, 
-                how='outer', 
-                left_on=['index_x', 'index_y'], 
-                right_on=['r_index', 'l_index'])
-
-data.rename(columns={'_sim_score': 'sim_score_overlap'}, inplace=True)
-
-
-# Overlap coefficient join
-
-# In[ ]:
-
+if STREAM_TOP_K:
+    from blocking import candidate_pairs
+    from topk import stream_top_k, pair_chunks, cross_chunks
 
-data = pd.merge(data, 
-                output_pairs_overlap_coefficient_join, 
-                how='outer', 
-                left_on=['index_x', 'index_y'], 
-                right_on=['r_index', 'l_index'])
+    if BLOCKING_MIN_OVERLAP > 0:
+        pairs = candidate_pairs(outdata_orbis['name_clean'], outdata_gdelt['name_gdelt'], min_overlap=BLOCKING_MIN_OVERLAP)
+        chunks = pair_chunks(pairs['left'], pairs['right'])
+    else:
+        chunks = cross_chunks(len(outdata_orbis), len(outdata_gdelt))
 
-data.rename(columns={'_sim_score': 'sim_score_overlap_coefficient'}, inplace=True)
+    display('Match processing will take some time...')
+    data = stream_top_k(outdata_orbis, outdata_gdelt, chunks, name_features, 
+                        k=STREAM_TOP_K, 
+                        rename=MASTER_COLUMNS, 
+                        exact=EXACT_SCORES, 
+                        path='./output/matches_topk.parquet', 
+                        **SIM_THRESHOLDS)
+    display(str(len(data)) + ' candidates kept.')
 
 
 # In[ ]:
 
 
-data.to_csv('./output/matches_raw.csv')
+if not STREAM_TOP_K:
+    data.to_csv('./output/matches_raw.csv')
 
 
 # # Sorting
@@ -607,6 +481,7 @@ data.to_csv('./output/matches_raw.csv')
 # In[ ]:
 
 
+import os
 import pandas as pd
 
 
@@ -616,8 +491,12 @@ import pandas as pd
 try:
     indata = data
 except:
-    indata = pd.read_csv('./output/matches_raw.csv')
-    indata.drop(columns=['Unnamed: 0'], inplace=True)
+    # Top-k survivors of the streaming mode (or of partitioned_runner.py), else the full table.
+    if os.path.exists('./output/matches_topk.parquet'):
+        indata = pd.read_parquet('./output/matches_topk.parquet')
+    else:
+        indata = pd.read_csv('./output/matches_raw.csv')
+        indata.drop(columns=['Unnamed: 0'], inplace=True)
 
 
 # In[ ]:
@@ -0,0 +1,105 @@
+# Per-name feature store.
+#
+# Cleaned name, metaphones, token set and character n-gram signature are computed once
+# for every distinct raw name (Orbis or GDelt) and kept on disk, keyed by the raw name
+# and CLEANING_VERSION. The pair tables only carry integer name ids; features are looked
+# up by id instead of being recomputed for every pair a name takes part in. Later runs
+# over overlapping name lists only compute the names they have not seen yet.
+
+import glob
+import os
+import sys
+import time
+import uuid
+import zlib
+
+import jellyfish
+import numpy as np
+import pandas as pd
+from fuzzywuzzy.utils import full_process
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from name_normalizer import company_name, normalize
+
+# Directory of the store. Every run appends a part file with the names it added, named by
+# time and a random suffix so that concurrent runs never write the same file.
+FEATURES_PATH = './output/name_features'
+
+# Bump this whenever the cleaning changes, so stored features are recomputed.
+CLEANING_VERSION = 1
+
+
+# Method to clean a name with the same chain as the notebook: lower, strip, parenthesis,
+# punctuation, company suffixes (basename twice because of multiple suffixes), extra
+# whitespace. See name_normalizer.py.
+def clean_name(name):
+    return company_name(name)
+
+
+# Method to get the sorted, de-duplicated crc32 hashes of the space padded character n-grams of each word
+def ngram_signature(name, n=3):
+    grams = set()
+    for word in name.split():
+        word = f' {word} '
+        grams.update(word[i:i + n] for i in range(max(len(word) - n + 1, 1)))
+    return sorted(zlib.crc32(g.encode('utf-8')) for g in grams)
+
+
+# Method to compute the features of every name, one row per name
+def compute_features(names, workers=1):
+    cleaned = normalize(names, company_name, workers=workers)
+    rows = []
+    for name, clean in zip(names, cleaned):
+        rows.append({
+            'name': name,
+            'version': CLEANING_VERSION,
+            'name_clean': clean,
+            'metaphone': jellyfish.metaphone(clean),
+            'metaphone_raw': jellyfish.metaphone(name.lower()),
+            # Sorted tokens as fuzz.token_sort_ratio sees them; ' '.join(tokens) is its sort key.
+            'tokens': sorted(full_process(clean, force_ascii=True).split()),
+            'ngrams': ngram_signature(clean),
+        })
+    return pd.DataFrame(rows, columns=['name', 'version', 'name_clean', 'metaphone', 'metaphone_raw', 'tokens', 'ngrams'])
+
+
+# Method to load all stored features of one cleaning version. The row number is the name id.
+# A name added by two runs at the same time is kept once.
+def load_features(path=FEATURES_PATH, version=CLEANING_VERSION):
+    parts = sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+    if not parts:
+        return compute_features([])
+    features = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+    features = features[features['version'] == version].drop_duplicates('name')
+    return features.reset_index(drop=True)
+
+
+# Method to write the features of new names as a new part of the store. The part is written
+# to a temporary name first, so load_features never reads a half written file.
+def append_features(features, path=FEATURES_PATH):
+    os.makedirs(path, exist_ok=True)
+    name = f'part-{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex}.parquet'
+    tmp = os.path.join(path, name + '.tmp')
+    features.to_parquet(tmp, index=False)
+    os.replace(tmp, os.path.join(path, name))
+
+
+# Method to look names up in the store. Returns (ids, features): the name id of every input
+# name (aligned with names) and the feature table the ids point into. Names that are not in
+# the store yet are computed once each (over workers processes) and appended to it.
+def lookup(names, path=FEATURES_PATH, version=CLEANING_VERSION, workers=1):
+    names = pd.Series(names, dtype=object).astype(str)
+    features = load_features(path, version)
+    new_names = pd.Index(names.unique()).difference(pd.Index(features['name']))
+    if len(new_names) > 0:
+        new_features = compute_features(list(new_names), workers)
+        append_features(new_features, path)
+        features = pd.concat([features, new_features], ignore_index=True).drop_duplicates('name').reset_index(drop=True)
+
+    ids = pd.Index(features['name']).get_indexer(names)
+    return ids, features
+
+
+# Method to get the token_sort_ratio keys of every name id
+def sort_keys(features):
+    return features['tokens'].map(' '.join).to_numpy(dtype=object)
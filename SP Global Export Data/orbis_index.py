@@ -0,0 +1,223 @@
+# Persistent Orbis name index.
+#
+# The cleaned Orbis names are indexed once: a TF-IDF matrix of their character n-grams
+# (rows are l2 normalized, so a dot product is the cosine similarity) and token postings
+# (for every whole token, the Orbis rows that contain it). Both are saved as plain NumPy
+# arrays and memory mapped on load, so new GDelt / GKG organization batches can be
+# matched against Orbis without reading the Orbis Excel file or cleaning it again.
+#
+# Build:  python orbis_index.py build --orbis ./input/orbis_test_large.xlsx
+# Query:  python orbis_index.py query --gdelt ./input/gdelt_test.csv --out ./output/candidates.csv
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize as l2_normalize
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from name_features import CLEANING_VERSION
+from name_normalizer import company_name, normalize
+from gkg_parser import organization_counts, read_organizations
+from scoring import SCORE_COLUMNS, score_pairs
+
+INDEX_PATH = './output/orbis_index'
+
+# Orbis column with the "official" company names.
+ORBIS_COLUMN = 'Company name Latin alphabet'
+
+# Cells (query names x Orbis names) of the dense similarity block of one query chunk, 2**25 float32 = 128 MiB
+QUERY_CELLS = 2**25
+
+
+# Method to save a CSR matrix as three .npy arrays
+def _save_csr(path, name, matrix):
+    for part in ['data', 'indices', 'indptr']:
+        np.save(os.path.join(path, f'{name}_{part}.npy'), getattr(matrix, part))
+
+
+# Method to load a CSR matrix saved by _save_csr. The arrays stay memory mapped, scipy does not copy them.
+def _load_csr(path, name, shape):
+    parts = [np.load(os.path.join(path, f'{name}_{part}.npy'), mmap_mode='r') for part in ['data', 'indices', 'indptr']]
+    return sparse.csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+# Method to get the binary name x token matrix over a fixed token vocabulary; unknown tokens are dropped
+def token_matrix(names, vocabulary):
+    indptr = [0]
+    indices = []
+    for name in names:
+        indices.extend(sorted({vocabulary[t] for t in str(name).split() if t in vocabulary}))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(names), len(vocabulary)))
+
+
+# Method to clean and index the raw Orbis names, overwrite the index at path and return it loaded
+def build_index(names, path=INDEX_PATH, n=3, workers=1):
+    names = pd.Series(names, dtype=object).dropna().astype(str).drop_duplicates().reset_index(drop=True)
+    cleaned = normalize(names, company_name, workers=workers)
+
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=(n, n), lowercase=False, dtype=np.float32)
+    tfidf = vectorizer.fit_transform(cleaned).tocsr()
+
+    tokens = {}
+    for name in cleaned:
+        for token in name.split():
+            tokens.setdefault(token, len(tokens))
+    # Postings: token x Orbis row, i.e. for every token the sorted rows that contain it
+    postings = token_matrix(cleaned, tokens).T.tocsr()
+    postings.sort_indices()
+
+    os.makedirs(path, exist_ok=True)
+    pd.DataFrame({'name_original': names, 'name_clean': cleaned}).to_parquet(os.path.join(path, 'names.parquet'), index=False)
+    _save_csr(path, 'tfidf', tfidf)
+    _save_csr(path, 'postings', postings)
+    np.save(os.path.join(path, 'idf.npy'), vectorizer.idf_.astype(np.float32))
+    meta = {
+        'version': CLEANING_VERSION,
+        'n': n,
+        'size': len(names),
+        'ngrams': {g: int(i) for g, i in vectorizer.vocabulary_.items()},
+        'tokens': tokens,
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return load_index(path)
+
+
+# Method to load the index at path, memory mapped
+def load_index(path=INDEX_PATH):
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != CLEANING_VERSION:
+        raise ValueError(f'Index at {path} was built with cleaning version {meta["version"]}, '
+                         f'current version is {CLEANING_VERSION}. Build it again.')
+
+    names = pd.read_parquet(os.path.join(path, 'names.parquet'))
+    return {
+        'meta': meta,
+        'names': names,
+        'tfidf': _load_csr(path, 'tfidf', (meta['size'], len(meta['ngrams']))),
+        'postings': _load_csr(path, 'postings', (len(meta['tokens']), meta['size'])),
+        'idf': np.load(os.path.join(path, 'idf.npy'), mmap_mode='r'),
+    }
+
+
+# Method to get the TF-IDF rows of cleaned names over the index vocabulary (same weighting as the build)
+def vectorize(index, cleaned):
+    n = index['meta']['n']
+    counts = CountVectorizer(analyzer='char_wb', ngram_range=(n, n), lowercase=False,
+                             vocabulary=index['meta']['ngrams'], dtype=np.float32).transform(cleaned)
+    return l2_normalize(counts.multiply(np.asarray(index['idf'])).tocsr())
+
+
+# Method to get the top_k Orbis rows of every query row of vectors by TF-IDF cosine similarity (at least
+# min_score, never 0), best first. The query rows are scored in chunks of QUERY_CELLS similarity cells:
+# one sparse product against the memory mapped index per chunk, and np.argpartition over the whole block.
+# Returns the query rows, Orbis rows and scores of the candidates.
+def top_matches(index, vectors, top_k=10, min_score=0.5, cells=QUERY_CELLS):
+    tfidf_t = index['tfidf'].T
+    n_orbis = tfidf_t.shape[1]
+    k = min(top_k, n_orbis)
+    rows, cols, values = [], [], []
+    if k == 0:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=np.float32)
+
+    step = max(cells // n_orbis, 1)
+    for start in range(0, vectors.shape[0], step):
+        block = (vectors[start:start + step] @ tfidf_t).toarray()
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(block, best, axis=1)
+        # Best first, ties by Orbis row
+        order = np.lexsort((best, -scores), axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+
+        keep = (scores >= min_score) & (scores > 0)
+        rows.append(np.nonzero(keep)[0] + start)
+        cols.append(best[keep])
+        values.append(scores[keep])
+    rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    cols = np.concatenate(cols) if cols else np.array([], dtype=int)
+    values = np.concatenate(values) if values else np.array([], dtype=np.float32)
+    return rows, cols, values
+
+
+# Method to get the scored Orbis candidates of every name: the top_k Orbis names by TF-IDF cosine
+# similarity (at least min_score), the number of whole tokens they share, and the fuzz / jaro scores
+def query(index, names, top_k=10, min_score=0.5, exact=True, workers=1):
+    names = pd.Series(names, dtype=object).dropna().astype(str).drop_duplicates().reset_index(drop=True)
+    cleaned = normalize(names, company_name, workers=workers)
+
+    rows, cols, values = top_matches(index, vectorize(index, cleaned), top_k=top_k, min_score=min_score)
+
+    shared = token_matrix(cleaned, index['meta']['tokens']) @ index['postings']
+    orbis = index['names']
+    candidates = pd.DataFrame({
+        'name_gdelt': names.to_numpy()[rows],
+        'name_clean_gdelt': cleaned.to_numpy()[rows],
+        'name_original_orbis': orbis['name_original'].to_numpy()[cols],
+        'name_clean_orbis': orbis['name_clean'].to_numpy()[cols],
+        'tfidf_score': values,
+        'shared_tokens': np.asarray(shared[rows, cols]).ravel().astype('int64') if len(rows) else np.array([], dtype='int64'),
+    })
+
+    scores = score_pairs(candidates['name_clean_gdelt'], candidates['name_clean_orbis'], exact=exact, workers=workers)
+    for col in SCORE_COLUMNS:
+        candidates[col] = scores[col]
+    return candidates
+
+
+# Method to run the build / query command line
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the persistent Orbis name index.')
+    parser.add_argument('--index', default=INDEX_PATH, help='index directory')
+    parser.add_argument('--workers', type=int, default=1)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='index the names of an Orbis Excel export')
+    build.add_argument('--orbis', required=True, help='Orbis Excel file')
+    build.add_argument('--rows', type=int, default=None, help='number of Orbis rows to index')
+    build.add_argument('--n', type=int, default=3, help='character n-gram size')
+
+    batch = commands.add_parser('query', help='score the organizations of a GKG batch against the index')
+    batch.add_argument('--gdelt', required=True, help='CSV file of GKG records')
+    batch.add_argument('--column', default='organizations', help="column with GKG organizations, or with plain names (--plain)")
+    batch.add_argument('--plain', action='store_true', help='the column holds one name per row')
+    batch.add_argument('--top-k', type=int, default=10)
+    batch.add_argument('--min-score', type=float, default=0.5)
+    batch.add_argument('--fast', action='store_true', help='rapidfuzz for every score (see scoring.py)')
+    batch.add_argument('--out', default=None, help='output CSV, printed when omitted')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        orbis = pd.read_excel(args.orbis)[ORBIS_COLUMN][:args.rows]
+        index = build_index(orbis, args.index, n=args.n, workers=args.workers)
+        print(f'Indexed {index["meta"]["size"]} Orbis names in {args.index}')
+        return
+
+    if args.plain:
+        counts = pd.read_csv(args.gdelt, usecols=[args.column])[args.column].dropna().astype(str).value_counts()
+        organizations = pd.DataFrame({'name_gdelt': counts.index, 'freq_gdelt': counts.to_numpy()})
+    else:
+        organizations = organization_counts(read_organizations(args.gdelt, args.column))
+
+    index = load_index(args.index)
+    candidates = query(index, organizations['name_gdelt'], top_k=args.top_k, min_score=args.min_score,
+                       exact=not args.fast, workers=args.workers)
+    candidates = candidates.merge(organizations, on='name_gdelt', how='left')
+    if args.out:
+        candidates.to_csv(args.out, index=False)
+        print(f'{len(candidates)} candidates for {len(organizations)} organizations written to {args.out}')
+    else:
+        print(candidates.to_csv(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+# Out-of-core, partitioned run of the fuzzy matching pipeline.
+#
+# fuzzy_matching.py keeps every name and pair in memory, which is why it only processes
+# NUM_ROWS_ORBIS Orbis rows and a range of GDelt rows. This runner processes all of them:
+#
+# 1. The Orbis names are split into shards. The GDelt organizations file is read in
+#    blocks; the mention counts of every block are spilled to hash buckets on disk, and
+#    every bucket is summed up and split into shards.
+# 2. The features of every shard (cleaned name, metaphones, ...) are computed once, and
+#    the n-gram document frequencies of the cleaned names are counted once over all shards,
+#    so every shard pair orders the n-grams of the blocking step the same way. Every worker
+#    of the matching loads them and fits the blocking vectorizer once (see init_worker).
+# 3. Every GDelt shard is split into row ranges whose candidate pairs with an Orbis shard
+#    fit the memory budget, from the share of pairs the blocking keeps on a sample (see
+#    gdelt_slices). Every (Orbis shard, GDelt range) pair is matched in a process pool with
+#    the streaming top-k scorer (see topk.py), which keeps the best TOP_K GDelt candidates
+#    of every Orbis name of the shard.
+# 4. The results of every Orbis shard are merged into one top-k and written to
+#    OUTPUT_PATH, which the notebook's sorting step reads.
+#
+# Every step writes its files atomically and skips the files that already exist, so an
+# interrupted run resumes where it stopped. Shard sizes and chunk sizes follow from
+# MAX_RSS_MB (see shard_plan) and from the candidate pairs the blocking actually keeps,
+# so peak memory does not depend on the input size.
+
+import glob
+import json
+import math
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv
+
+from blocking import candidate_pairs, fit_blocker, ngram_doc_freq
+from gkg_parser import organization_counts, parse_organizations
+from name_features import compute_features
+from topk import cross_chunks, keep_top_k, pair_chunks, stream_top_k
+
+# resource (peak RSS) only exists on Unix, psutil is used instead where it is installed
+try:
+    import resource
+except ImportError:
+    resource = None
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+# Inputs
+ORBIS_INPUT = './input/orbis_test_large.xlsx' # Excel (or CSV)
+ORBIS_COLUMN = 'Company name Latin alphabet'
+GDELT_INPUT = './input/gdelt_test.csv' # CSV
+GDELT_COLUMN = 'organizations'
+
+# Outputs
+WORK_DIR = './output/partitioned'
+OUTPUT_PATH = './output/matches_topk.parquet'
+
+# Memory budget of the whole run (all workers together) and number of worker processes.
+MAX_RSS_MB = 8192
+WORKERS = os.cpu_count()
+
+# Matching settings, as in fuzzy_matching.py
+TOP_K = 100
+BLOCKING_MIN_OVERLAP = 0.5
+EXACT_SCORES = True
+SIM_THRESHOLDS = {'set_threshold': 0.1, 'distance_threshold': 50}
+
+# Rough sizes used to plan the shards: memory of a worker before it loads any data, of
+# one scored pair row, of one candidate pair position during blocking, and of the features
+# and n-grams of one GDelt name.
+BASE_RSS_MB = 300
+ROW_BYTES = 2_000
+POSITION_BYTES = 64
+NAME_BYTES = 2_000
+
+# Names sampled from each side to measure the share of pairs the blocking keeps, and the
+# margin kept on the measured number of candidate pairs when the GDelt shards are split
+SAMPLE_NAMES = 2_000
+CANDIDATE_MARGIN = 2.0
+
+# Bytes of the GDelt file read at once.
+BLOCK_BYTES = 64 * 2**20
+
+
+# Method to get the shard and chunk sizes that keep every worker within max_rss_mb / workers:
+# 40% for the scored chunk, 30% for the top-k survivors of the Orbis shard and 30% for
+# the blocking of a shard pair: the GDelt shard's names (gdelt_shard) and at most
+# max_candidates candidate pair positions. How many GDelt names that is depends on the
+# share of pairs the blocking keeps, see gdelt_slices.
+def shard_plan(max_rss_mb=MAX_RSS_MB, workers=WORKERS, k=TOP_K):
+    budget = (max_rss_mb / workers - BASE_RSS_MB) * 2**20
+    if budget <= 0:
+        raise ValueError(f'MAX_RSS_MB={max_rss_mb} leaves no memory for {workers} workers.')
+    return {
+        'chunksize': max(int(0.4 * budget / ROW_BYTES), 1),
+        'orbis_shard': max(int(0.3 * budget / (k * ROW_BYTES)), 1),
+        'gdelt_shard': max(int(0.15 * budget / NAME_BYTES), 1),
+        'max_candidates': max(int(0.15 * budget / POSITION_BYTES), 1),
+    }
+
+
+# Method to write a frame to parquet through a temporary file, so path only ever exists complete
+def write_parquet(frame, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    frame.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+# Method to split the distinct Orbis names in shards of shard_size. Returns the shard paths.
+def spill_orbis(path, work_dir, shard_size):
+    done = os.path.join(work_dir, 'orbis', 'shards.json')
+    if os.path.exists(done):
+        with open(done) as f:
+            return json.load(f)
+
+    read = pd.read_csv if path.endswith('.csv') else pd.read_excel
+    names = read(path)[ORBIS_COLUMN].dropna().astype(str).drop_duplicates()
+    shards = []
+    for start in range(0, len(names), shard_size):
+        shard = pd.DataFrame({'name_original': names.iloc[start:start + shard_size].to_numpy()})
+        shard_path = os.path.join(work_dir, 'orbis', f'shard-{len(shards):05d}.parquet')
+        write_parquet(shard, shard_path)
+        shards.append(shard_path)
+
+    os.makedirs(os.path.dirname(done), exist_ok=True)
+    with open(done, 'w') as f:
+        json.dump(shards, f)
+    return shards
+
+
+# Method to split the GDelt organization names and mention counts (name_original, freq_gdelt)
+# in shards of shard_size. The file is read block by block, and the counts of every block are
+# spilled to hash buckets, so a name is always counted in one bucket. Returns the shard paths.
+def spill_gdelt(path, work_dir, shard_size, column=GDELT_COLUMN, block_bytes=BLOCK_BYTES):
+    done = os.path.join(work_dir, 'gdelt', 'shards.json')
+    if os.path.exists(done):
+        with open(done) as f:
+            return json.load(f)
+
+    buckets = max(math.ceil(os.path.getsize(path) / block_bytes), 1)
+    bucket_dir = os.path.join(work_dir, 'gdelt', 'buckets')
+    for old in glob.glob(os.path.join(bucket_dir, '*', '*.parquet')):
+        os.remove(old)  # Partial spill of an interrupted run.
+
+    convert = csv.ConvertOptions(include_columns=[column], column_types={column: pa.large_string()})
+    reader = csv.open_csv(path, read_options=csv.ReadOptions(block_size=block_bytes), convert_options=convert)
+    for i, batch in enumerate(reader):
+        counts = organization_counts(parse_organizations(batch.column(column)))
+        bucket = pd.util.hash_array(counts['name_gdelt'].to_numpy(dtype=object)) % buckets
+        for b, part in counts.groupby(bucket):
+            write_parquet(part, os.path.join(bucket_dir, f'{b:05d}', f'part-{i:05d}.parquet'))
+
+    shards = []
+    for b in range(buckets):
+        parts = sorted(glob.glob(os.path.join(bucket_dir, f'{b:05d}', 'part-*.parquet')))
+        if not parts:
+            continue
+        counts = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+        counts = counts.groupby('name_gdelt', sort=False)['freq_gdelt'].sum().sort_values(ascending=False, kind='mergesort')
+        for start in range(0, len(counts), shard_size):
+            shard = pd.DataFrame({'name_original': counts.index[start:start + shard_size].to_numpy(dtype=object),
+                                  'freq_gdelt': counts.to_numpy()[start:start + shard_size]})
+            shard_path = os.path.join(work_dir, 'gdelt', f'shard-{len(shards):05d}.parquet')
+            write_parquet(shard, shard_path)
+            shards.append(shard_path)
+
+    os.makedirs(os.path.dirname(done), exist_ok=True)
+    with open(done, 'w') as f:
+        json.dump(shards, f)
+    return shards
+
+
+# Method to compute the features of every name of a shard, next to the shard (see
+# name_features.compute_features), and the n-gram document frequencies of its cleaned names
+def prepare_shard(path):
+    out = path.replace('shard-', 'features-')
+    if not os.path.exists(out):
+        shard = pd.read_parquet(path)
+        features = compute_features(shard['name_original'].tolist())
+        write_parquet(pd.concat([shard.drop(columns='name_original'), features], axis=1), out)
+    ngrams = path.replace('shard-', 'ngrams-')
+    if not os.path.exists(ngrams):
+        doc_freq = ngram_doc_freq(pd.read_parquet(out, columns=['name_clean'])['name_clean'])
+        write_parquet(doc_freq.rename_axis('ngram').reset_index(name='freq'), ngrams)
+    return out
+
+
+# Method to sum the n-gram document frequencies of all shards into work_dir/doc_freq.parquet,
+# one shard at a time
+def count_ngrams(feature_paths, work_dir):
+    out = os.path.join(work_dir, 'doc_freq.parquet')
+    if not os.path.exists(out):
+        doc_freq = pd.Series(dtype='int64')
+        for path in feature_paths:
+            part = pd.read_parquet(path.replace('features-', 'ngrams-')).set_index('ngram')['freq']
+            doc_freq = doc_freq.add(part, fill_value=0).astype('int64')
+        write_parquet(doc_freq.rename_axis('ngram').reset_index(name='freq'), out)
+    return out
+
+
+# Method to get the peak RSS of this process in MiB (0 if neither resource nor psutil is there)
+def peak_rss_mb():
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss) // 2**20
+    return 0
+
+
+# Blocking fitted to the n-gram document frequencies of the run (see blocking.fit_blocker),
+# set once in every worker process of the matching by init_worker
+_blocker = None
+
+
+# Method run once in every worker process of the matching: load the doc_freq file of
+# count_ngrams and fit the blocking vectorizer to it
+def init_worker(doc_freq_path):
+    global _blocker
+    _blocker = fit_blocker(pd.read_parquet(doc_freq_path).set_index('ngram')['freq'])
+
+
+# Method to draw about n cleaned names from feature files, the same share of every file,
+# reading one file at a time
+def sample_names(feature_paths, n=SAMPLE_NAMES, seed=0):
+    rows = [pq.ParquetFile(path).metadata.num_rows for path in feature_paths]
+    share = min(n / max(sum(rows), 1), 1)
+    parts = [pd.read_parquet(path, columns=['name_clean'])['name_clean'].sample(frac=share, random_state=seed)
+             for path in feature_paths]
+    return pd.concat(parts, ignore_index=True) if parts else pd.Series(dtype=object)
+
+
+# Method to split a GDelt shard (its features file) into row ranges (start, stop) whose candidate
+# pairs with an Orbis shard of n_orbis names fit in max_candidates. The share of pairs the
+# blocking keeps is measured on orbis_sample against a sample of the shard's names, and kept
+# with CANDIDATE_MARGIN; without blocking (min_overlap 0) every pair is a candidate.
+# Returns the share and the ranges.
+def gdelt_slices(gdelt_path, orbis_sample, n_orbis, max_candidates, min_overlap=BLOCKING_MIN_OVERLAP, blocker=None):
+    names = pd.read_parquet(gdelt_path, columns=['name_clean'])['name_clean']
+    share = 1.0
+    if min_overlap > 0 and len(names) and len(orbis_sample):
+        sample = names.sample(min(len(names), SAMPLE_NAMES), random_state=0)
+        pairs = candidate_pairs(orbis_sample, sample, min_overlap=min_overlap,
+                                blocker=blocker if blocker is not None else _blocker)
+        share = len(pairs) / (len(orbis_sample) * len(sample))
+    per_name = CANDIDATE_MARGIN * share * n_orbis
+    size = len(names) if per_name == 0 else min(max(int(max_candidates / per_name), 1), len(names))
+    return share, [(start, min(start + size, len(names))) for start in range(0, len(names), max(size, 1))]
+
+
+# Method to get the row ranges of every GDelt shard (see gdelt_slices), measured in the pool
+# once and kept in work_dir/slices.json, so a resumed run matches the same ranges
+def slice_plan(pool, orbis_features, gdelt_features, work_dir, max_candidates, min_overlap=BLOCKING_MIN_OVERLAP):
+    done = os.path.join(work_dir, 'slices.json')
+    if os.path.exists(done):
+        with open(done) as f:
+            return json.load(f)
+
+    orbis_sample = sample_names(orbis_features)
+    n_orbis = max((pq.ParquetFile(path).metadata.num_rows for path in orbis_features), default=0)
+    n = len(gdelt_features)
+    measured = list(pool.map(gdelt_slices, gdelt_features, [orbis_sample] * n, [n_orbis] * n,
+                             [max_candidates] * n, [min_overlap] * n))
+    if measured:
+        print(f'Blocking keeps {max(share for share, _ in measured):.4%} of the pairs at most, '
+              f'{sum(len(ranges) for _, ranges in measured)} GDelt ranges')
+    slices = [ranges for _, ranges in measured]
+    with open(done, 'w') as f:
+        json.dump(slices, f)
+    return slices
+
+
+# Method to find the top-k GDelt candidates of every Orbis name of one shard pair, written to out.
+# rows (start, stop) only matches that range of the GDelt shard. The blocking uses blocker, by
+# default the one init_worker fitted (fitted to the shard pair alone when there is none).
+# Returns the peak RSS of the worker in MiB and the number of candidate pairs (None when out
+# already exists).
+def match_shards(orbis_path, gdelt_path, out, k=TOP_K, chunksize=500_000, min_overlap=BLOCKING_MIN_OVERLAP,
+                 rows=None, exact=EXACT_SCORES, sim_kwargs=SIM_THRESHOLDS, blocker=None):
+    n_candidates = None
+    if not os.path.exists(out):
+        orbis_features = pd.read_parquet(orbis_path)
+        gdelt_features = pd.read_parquet(gdelt_path)
+        if rows is not None:
+            gdelt_features = gdelt_features.iloc[rows[0]:rows[1]].reset_index(drop=True)
+        features = pd.concat([orbis_features, gdelt_features], ignore_index=True)
+
+        # Same columns as in fuzzy_matching.py; name ids point into features.
+        orbis = pd.DataFrame({'name_original': orbis_features['name'],
+                              'name': orbis_features['name'].str.lower(),
+                              'name_id': np.arange(len(orbis_features)),
+                              'name_clean': orbis_features['name_clean']})
+        gdelt = pd.DataFrame({'name_gdelt': gdelt_features['name_clean'],
+                              'freq_gdelt': gdelt_features['freq_gdelt'],
+                              'name_original': gdelt_features['name'],
+                              'name_id': len(orbis_features) + np.arange(len(gdelt_features))})
+
+        if min_overlap > 0:
+            pairs = candidate_pairs(orbis['name_clean'], gdelt['name_gdelt'], min_overlap=min_overlap,
+                                    blocker=blocker if blocker is not None else _blocker)
+            n_candidates = len(pairs)
+            chunks = pair_chunks(pairs['left'], pairs['right'], chunksize)
+        else:
+            n_candidates = len(orbis) * len(gdelt)
+            chunks = cross_chunks(len(orbis), len(gdelt), chunksize)
+        survivors = stream_top_k(orbis, gdelt, chunks, features, k=k, exact=exact, workers=1, **sim_kwargs)
+        write_parquet(survivors.drop(columns=['name_id_orbis', 'name_id_gdelt'], errors='ignore'), out)
+    return peak_rss_mb(), n_candidates
+
+
+def _match_shards(args):
+    return match_shards(*args)
+
+
+# Method to fold the shard pair results of one Orbis shard into its top-k, one file at a time
+def merge_shard(paths, out, k=TOP_K):
+    if not os.path.exists(out):
+        merged = None
+        for path in paths:
+            part = pd.read_parquet(path)
+            if part.empty:
+                continue
+            merged = part if merged is None else pd.concat([merged, part], ignore_index=True)
+            merged = keep_top_k(merged, k, group='name_original_orbis')
+        write_parquet(merged if merged is not None else pd.DataFrame(), out)
+    return out
+
+
+# Method to run the whole matching, see the top of the file
+def run(orbis_input=ORBIS_INPUT, gdelt_input=GDELT_INPUT, work_dir=WORK_DIR, output_path=OUTPUT_PATH,
+        max_rss_mb=MAX_RSS_MB, workers=WORKERS, k=TOP_K, min_overlap=BLOCKING_MIN_OVERLAP):
+    plan = shard_plan(max_rss_mb, workers, k)
+    print(f'Plan: {plan}')
+
+    # Shards of an earlier run can only be reused with the same plan.
+    plan_path = os.path.join(work_dir, 'plan.json')
+    if os.path.exists(plan_path):
+        with open(plan_path) as f:
+            previous = json.load(f)
+        if previous != {**plan, 'k': k, 'min_overlap': min_overlap}:
+            raise ValueError(f'{work_dir} holds a run with plan {previous}. Remove it or use the same settings.')
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+        with open(plan_path, 'w') as f:
+            json.dump({**plan, 'k': k, 'min_overlap': min_overlap}, f)
+
+    orbis_shards = spill_orbis(orbis_input, work_dir, plan['orbis_shard'])
+    gdelt_shards = spill_gdelt(gdelt_input, work_dir, plan['gdelt_shard'])
+    print(f'{len(orbis_shards)} Orbis shards, {len(gdelt_shards)} GDelt shards')
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        orbis_features = list(pool.map(prepare_shard, orbis_shards))
+        gdelt_features = list(pool.map(prepare_shard, gdelt_shards))
+    doc_freq_path = count_ngrams(orbis_features + gdelt_features, work_dir)
+
+    # The workers of the matching load doc_freq and fit the blocking once, not once per shard pair
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(doc_freq_path,)) as pool:
+        slices = slice_plan(pool, orbis_features, gdelt_features, work_dir, plan['max_candidates'], min_overlap)
+
+        tasks = []
+        for i, orbis_path in enumerate(orbis_features):
+            for j, gdelt_path in enumerate(gdelt_features):
+                for s, rows in enumerate(slices[j]):
+                    out = os.path.join(work_dir, 'matches', f'orbis-{i:05d}', f'gdelt-{j:05d}-{s:05d}.parquet')
+                    tasks.append((orbis_path, gdelt_path, out, k, plan['chunksize'], min_overlap, tuple(rows)))
+        todo = [t for t in tasks if not os.path.exists(t[2])]
+        print(f'{len(tasks) - len(todo)} of {len(tasks)} shard pairs already done')
+        done = list(pool.map(_match_shards, todo))
+        peak = max((rss for rss, _ in done), default=0)
+        n_candidates = sum(n for _, n in done if n is not None)
+        print(f'{n_candidates} candidate pairs, peak worker RSS: {peak} MiB')
+        if todo and n_candidates == 0:
+            warnings.warn(f'Blocking found no candidate pairs (min_overlap={min_overlap}). '
+                          'Check the input columns or lower BLOCKING_MIN_OVERLAP.')
+
+        merged = list(pool.map(merge_shard,
+                               [sorted(glob.glob(os.path.join(work_dir, 'matches', f'orbis-{i:05d}', '*.parquet')))
+                                for i in range(len(orbis_features))],
+                               [os.path.join(work_dir, 'top', f'orbis-{i:05d}.parquet') for i in range(len(orbis_features))],
+                               [k] * len(orbis_features)))
+
+    # Stream the merged shards into one file
+    writer = None
+    for path in merged:
+        table = pq.read_table(path)
+        if table.num_rows == 0:
+            continue
+        if writer is None:
+            tmp = f'{output_path}.{os.getpid()}.tmp'
+            writer = pq.ParquetWriter(tmp, table.schema)
+        writer.write_table(table.cast(writer.schema))
+    if writer is not None:
+        writer.close()
+        os.replace(tmp, output_path)
+    else:
+        warnings.warn(f'No matches: {output_path} is written empty.')
+        write_parquet(pd.DataFrame(), output_path)
+    print(f'Top {k} matches of every Orbis name written to {output_path}')
+
+
+if __name__ == "__main__":
+    run()
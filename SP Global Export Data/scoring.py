@@ -0,0 +1,144 @@
+# Batched scoring of name pairs.
+#
+# Computes fuzz_ratio, fuzz_partial_ratio, fuzz_token_sort_ratio and jaro_distance for
+# whole arrays of pairs in one pass. The pairs are cut into chunks that are scored in
+# worker processes, and every measure comes back as a NumPy array in pair order.
+#
+# The values are the ones FuzzyWuzzy (with python-Levenshtein) and Jellyfish give, so
+# the match thresholds (total_score_name > 280, jaro_distance > 0.9) still apply:
+# - ratio and token sort ratio use rapidfuzz's pairwise scorer (same edit distance
+#   as python-Levenshtein) after FuzzyWuzzy's own token sort preprocessing.
+# - partial ratio and jaro use FuzzyWuzzy / Jellyfish when exact=True. rapidfuzz's
+#   partial ratio searches all alignments (so can score higher) and its jaro can differ
+#   in the last bit, so exact=False is faster but not identical.
+#
+# With exact=True these two measures are still one Python call per pair (inside the
+# worker processes), and take most of the scoring time. Only exact=False scores every
+# measure with rapidfuzz's vectorized cpdist.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import jellyfish
+import numpy as np
+import pandas as pd
+from fuzzywuzzy import fuzz
+from fuzzywuzzy.utils import full_process
+from rapidfuzz import fuzz as rfuzz
+from rapidfuzz.distance import Jaro
+from rapidfuzz.process import cpdist
+
+from name_features import sort_keys
+
+SCORE_COLUMNS = ['fuzz_ratio', 'fuzz_partial_ratio', 'fuzz_token_sort_ratio', 'jaro_distance']
+
+# jaro_distance was renamed jaro_similarity in newer Jellyfish releases.
+jaro_similarity = getattr(jellyfish, 'jaro_similarity', None) or jellyfish.jaro_distance
+
+
+# Method to get the string fuzz.token_sort_ratio compares: processed, split, sorted and joined
+def token_sort_key(name):
+    return ' '.join(sorted(full_process(name, force_ascii=True).split())).strip()
+
+
+# Method to score left[i] against right[i] for one chunk of pairs. Returns {measure: np.ndarray}.
+def score_chunk(left, right, exact=True, left_keys=None, right_keys=None):
+    scores = {}
+    scores['fuzz_ratio'] = np.rint(cpdist(left, right, scorer=rfuzz.ratio)).astype('int64')
+
+    # Per-pair loop, see the top of the file
+    if exact:
+        scores['fuzz_partial_ratio'] = np.fromiter(
+            (fuzz.partial_ratio(a, b) for a, b in zip(left, right)), dtype='int64', count=len(left))
+    else:
+        scores['fuzz_partial_ratio'] = np.rint(cpdist(left, right, scorer=rfuzz.partial_ratio)).astype('int64')
+
+    # Sort keys come from the feature store, or are computed once per distinct name
+    if left_keys is None or right_keys is None:
+        keys = {name: token_sort_key(name) for name in set(left) | set(right)}
+        left_keys = [keys[a] for a in left]
+        right_keys = [keys[b] for b in right]
+    scores['fuzz_token_sort_ratio'] = np.rint(cpdist(left_keys, right_keys, scorer=rfuzz.ratio)).astype('int64')
+
+    # Per-pair loop, see the top of the file
+    if exact:
+        scores['jaro_distance'] = np.fromiter(
+            (jaro_similarity(a, b) for a, b in zip(left, right)), dtype='float64', count=len(left))
+    else:
+        jaro = cpdist(left, right, scorer=Jaro.normalized_similarity, dtype=np.float64)
+        empty = (np.fromiter(map(len, left), int, len(left)) == 0) | (np.fromiter(map(len, right), int, len(right)) == 0)
+        jaro[empty] = 0.0
+        scores['jaro_distance'] = jaro
+    return scores
+
+
+def _score_chunk(args):
+    return score_chunk(*args)
+
+
+# Method to score left[i] against right[i] for every i, in chunks over worker processes.
+# Returns {measure: np.ndarray}. left_keys/right_keys are optional precomputed token sort keys
+# (see name_features.sort_keys).
+def score_pairs(left, right, exact=True, workers=None, chunksize=50_000, left_keys=None, right_keys=None):
+    left = [str(x) for x in left]
+    right = [str(x) for x in right]
+    with_keys = left_keys is not None and right_keys is not None
+    if with_keys:
+        left_keys = list(left_keys)
+        right_keys = list(right_keys)
+    chunks = [(left[i:i + chunksize], right[i:i + chunksize], exact,
+               left_keys[i:i + chunksize] if with_keys else None,
+               right_keys[i:i + chunksize] if with_keys else None)
+              for i in range(0, len(left), chunksize)]
+    if not chunks:
+        return {col: np.array([], dtype='float64' if col == 'jaro_distance' else 'int64') for col in SCORE_COLUMNS}
+
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(chunks) == 1:
+        results = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_score_chunk, chunks))
+    return {col: np.concatenate([r[col] for r in results]) for col in SCORE_COLUMNS}
+
+
+# Method to score pairs given as integer name ids into names (e.g. the feature store's
+# name_clean), with optional token sort keys per id
+def score_id_pairs(left_ids, right_ids, names, keys=None, **kwargs):
+    names = np.asarray(names, dtype=object)
+    left_ids = np.asarray(left_ids)
+    right_ids = np.asarray(right_ids)
+    if keys is not None:
+        keys = np.asarray(keys, dtype=object)
+        kwargs['left_keys'] = keys[left_ids]
+        kwargs['right_keys'] = keys[right_ids]
+    return score_pairs(names[left_ids], names[right_ids], **kwargs)
+
+
+# Method to add the four score columns (with an optional prefix, e.g. 'metaphone_') to data
+def score_frame(data, left_col, right_col, prefix='', **kwargs):
+    scores = score_pairs(data[left_col], data[right_col], **kwargs)
+    for col, values in scores.items():
+        data[prefix + col] = values
+    return data
+
+
+# Method to add all name and metaphone scores to a pair table with name_id_orbis / name_id_gdelt
+# columns. features is the feature store table the ids point into (see name_features.load_features).
+def score_candidates(data, features, exact=True, workers=None):
+    gdelt_ids = data['name_id_gdelt'].to_numpy()
+    orbis_ids = data['name_id_orbis'].to_numpy()
+
+    scores = score_id_pairs(gdelt_ids, orbis_ids, features['name_clean'], sort_keys(features), exact=exact, workers=workers)
+    for col, values in scores.items():
+        data[col] = values
+
+    # Metaphones were computed once per name in the feature store, only look them up here
+    data['metaphone_unclean_orbis'] = features['metaphone_raw'].to_numpy()[orbis_ids]
+    data['metaphone_clean_orbis'] = features['metaphone'].to_numpy()[orbis_ids]
+    data['metaphone_gdelt'] = features['metaphone'].to_numpy()[gdelt_ids]
+
+    scores = score_id_pairs(gdelt_ids, orbis_ids, features['metaphone'], exact=exact, workers=workers)
+    for col, values in scores.items():
+        data['metaphone_' + col] = values
+    return data
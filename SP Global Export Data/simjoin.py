@@ -0,0 +1,83 @@
+# Multi-measure similarity join on the pair table.
+#
+# Replaces the six py_stringsimjoin joins (edit distance, jaccard, cosine, dice, overlap,
+# overlap coefficient) and the six outer merges that brought their scores back into the
+# pair table. Names are tokenized once (whitespace token sets, like
+# sm.WhitespaceTokenizer(return_set=True)), every measure is computed for the pairs
+# that are already in the table, and the six sim_score_* columns are written in place.
+# A score is NaN when the pair does not pass that join's threshold, as it was after the
+# merges.
+
+import numpy as np
+from rapidfuzz.distance import Levenshtein
+from rapidfuzz.process import cpdist
+from scipy import sparse
+
+SIM_COLUMNS = [
+    'sim_score_distance',
+    'sim_score_jaccard',
+    'sim_score_cosine',
+    'sim_score_dice',
+    'sim_score_overlap',
+    'sim_score_overlap_coefficient',
+]
+
+
+# Method to get the binary name x token matrix of the whitespace token sets of names
+def token_matrix(names):
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    for name in names:
+        for token in set(str(name).split()):
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(names), max(len(vocabulary), 1)))
+
+
+# Method to get the scores of names[left_ids[i]] vs names[right_ids[i]] for every pair i,
+# as {column: np.ndarray}
+def similarity_scores(left_ids, right_ids, names, set_threshold=0.1, distance_threshold=50, workers=-1):
+    names = np.asarray(names, dtype=object)
+    left_ids = np.asarray(left_ids)
+    right_ids = np.asarray(right_ids)
+
+    # Tokenize each name that takes part in a pair only once
+    used, inverse = np.unique(np.concatenate([left_ids, right_ids]), return_inverse=True)
+    tokens = token_matrix(names[used])
+    left_rows = inverse[:len(left_ids)]
+    right_rows = inverse[len(left_ids):]
+
+    size = np.asarray(tokens.sum(axis=1)).ravel().astype('float64')
+    size_left = size[left_rows]
+    size_right = size[right_rows]
+    shared = np.asarray(tokens[left_rows].multiply(tokens[right_rows]).sum(axis=1)).ravel().astype('float64')
+    both_empty = (size_left == 0) & (size_right == 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        measures = {
+            'sim_score_jaccard': shared / (size_left + size_right - shared),
+            'sim_score_cosine': shared / np.sqrt(size_left * size_right),
+            'sim_score_dice': 2 * shared / (size_left + size_right),
+            'sim_score_overlap_coefficient': shared / np.minimum(size_left, size_right),
+        }
+
+    scores = {}
+    distance = cpdist(names[left_ids].tolist(), names[right_ids].tolist(),
+                      scorer=Levenshtein.distance, workers=workers).astype('float64')
+    scores['sim_score_distance'] = np.where(distance <= distance_threshold, distance, np.nan)
+    for col, values in measures.items():
+        # Two empty token sets count as identical (allow_empty=True in py_stringsimjoin)
+        values = np.where(both_empty, 1.0, values)
+        scores[col] = np.where(values >= set_threshold, values, np.nan)
+    scores['sim_score_overlap'] = np.where(shared >= set_threshold, shared, np.nan)
+    return {col: scores[col] for col in SIM_COLUMNS}
+
+
+# Method to add the six sim_score_* columns to a pair table of name ids into names
+def add_similarity_scores(data, left_id_col, right_id_col, names, **kwargs):
+    scores = similarity_scores(data[left_id_col], data[right_id_col], names, **kwargs)
+    for col, values in scores.items():
+        data[col] = values
+    return data
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from blocking import candidate_pairs, fit_blocker, ngram_doc_freq, ngram_matrices
+
+
+# Method to make Zipf-style company names: words made of syllables drawn with Zipf weights,
+# so a few n-grams are in almost every name
+def zipf_names(n, rng, syllables=40, words=(1, 3)):
+    vocabulary = [''.join(rng.choice(list('abcdefghijklmnoprstuvy'), 2)) for _ in range(syllables)]
+    weights = 1.0 / np.arange(1, syllables + 1)
+    weights /= weights.sum()
+    names = []
+    for _ in range(n):
+        name = [''.join(rng.choice(vocabulary, rng.integers(1, 5), p=weights)) for _ in range(rng.integers(*words, endpoint=True))]
+        names.append(' '.join(name))
+    return pd.Series(names)
+
+
+# Method to find every pair with enough shared n-grams by brute force (dense overlap matrix)
+def brute_force(left, right, min_overlap):
+    A, B, _ = ngram_matrices(left, right)
+    shared = (A @ B.T).toarray()
+    size_left = np.asarray(A.sum(axis=1)).ravel()
+    size_right = np.asarray(B.sum(axis=1)).ravel()
+    keep = (shared > 0) & (shared >= min_overlap * np.minimum.outer(size_left, size_right))
+    return set(zip(*np.nonzero(keep)))
+
+
+@pytest.mark.parametrize('syllables', [40, 6])
+@pytest.mark.parametrize('min_overlap', [0.5, 0.8])
+def test_candidate_pairs_recall(syllables, min_overlap):
+    rng = np.random.default_rng(0)
+    orbis = zipf_names(3000, rng, syllables)
+    gdelt = pd.concat([zipf_names(700, rng, syllables), orbis.sample(300, random_state=1)], ignore_index=True)
+
+    pairs = candidate_pairs(orbis, gdelt, min_overlap=min_overlap)
+    assert set(zip(pairs['left'], pairs['right'])) == brute_force(orbis, gdelt, min_overlap)
+
+    # Every exact copy is a candidate of its original
+    found = set(zip(orbis.to_numpy()[pairs['left']], gdelt.to_numpy()[pairs['right']]))
+    assert all((name, name) in found for name in gdelt[700:] if name.strip())
+
+
+def test_candidate_pairs_do_not_depend_on_shards():
+    rng = np.random.default_rng(2)
+    orbis = zipf_names(600, rng, 10)
+    gdelt = zipf_names(400, rng, 10)
+    doc_freq = ngram_doc_freq(pd.concat([orbis, gdelt]))
+
+    whole = candidate_pairs(orbis, gdelt, doc_freq=doc_freq)
+    parts = []
+    for start in range(0, len(orbis), 250):
+        part = candidate_pairs(orbis[start:start + 250], gdelt, doc_freq=doc_freq)
+        parts.append(part.assign(left=part['left'] + start))
+    sharded = pd.concat(parts, ignore_index=True).sort_values(['left', 'right']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(whole, sharded, check_dtype=False)
+
+    # A blocker fitted once to doc_freq gives the same pairs
+    blocker = fit_blocker(doc_freq)
+    for start in range(0, len(orbis), 250):
+        part = candidate_pairs(orbis[start:start + 250], gdelt, doc_freq=doc_freq)
+        pd.testing.assert_frame_equal(candidate_pairs(orbis[start:start + 250], gdelt, blocker=blocker), part)
@@ -0,0 +1,79 @@
+# Streaming top-k matching.
+#
+# Instead of building the whole pair table (master_list), scoring it and sorting it,
+# the pairs are built and scored chunk by chunk, and only the best k GDelt candidates
+# of every Orbis name are kept between chunks. Memory grows with the number of Orbis
+# names times k instead of with the number of pairs. The survivors carry the same
+# columns as the full table, so the sorting, matching and output steps run unchanged.
+
+import numpy as np
+import pandas as pd
+
+from blocking import pair_frame
+from scoring import score_candidates
+from simjoin import add_similarity_scores
+
+# Candidates of an Orbis name are ranked like the sorting step of the notebook does.
+RANK_COLUMNS = ['fuzz_ratio', 'fuzz_partial_ratio', 'fuzz_token_sort_ratio']
+
+# Names of the '_x' (GDelt) / '_y' (Orbis) columns of the pair frame in master_list.
+MASTER_COLUMNS = {'name_x': 'name_gdelt', 
+                  'name_original_x': 'name_original_gdelt', 
+                  'name': 'name_orbis', 
+                  'name_clean': 'name_clean_orbis', 
+                  'name_original_y': 'name_original_orbis', 
+                  'name_id_x': 'name_id_gdelt', 
+                  'name_id_y': 'name_id_orbis'}
+
+
+# Method to go through the (Orbis positions, GDelt positions) of the candidate pairs, chunksize pairs at a time
+def pair_chunks(left, right, chunksize=500_000):
+    left = np.asarray(left)
+    right = np.asarray(right)
+    for i in range(0, len(left), chunksize):
+        yield left[i:i + chunksize], right[i:i + chunksize]
+
+
+# Method to go through every Orbis x GDelt pair (the cross join), without holding all of them at once
+def cross_chunks(n_left, n_right, chunksize=500_000):
+    total = n_left * n_right
+    for i in range(0, total, chunksize):
+        left, right = np.divmod(np.arange(i, min(i + chunksize, total)), n_right)
+        yield left, right
+
+
+# Method to keep the k best rows of every group, best first
+def keep_top_k(data, k, group='name_id_orbis', by=RANK_COLUMNS):
+    data = data.sort_values([group] + by, ascending=[True] + [False] * len(by), kind='mergesort')
+    return data[data.groupby(group, sort=False).cumcount() < k]
+
+
+# Method to score every chunk of (Orbis positions, GDelt positions) pairs like the notebook
+# scores master_list (fuzz / jaro for names and metaphones, similarity joins) and keep the
+# k best candidates of every Orbis name. rename maps the '_x'/'_y' columns of the pair frame
+# to their master_list names. Writes the survivors to path (Parquet).
+# workers is the number of processes / threads the scorers use (None: all cores).
+def stream_top_k(orbis, gdelt, chunks, features, k=100, rename=MASTER_COLUMNS, exact=True, path=None,
+                 workers=None, **sim_kwargs):
+    survivors = None
+    for left, right in chunks:
+        data = pair_frame(orbis, gdelt, left, right)
+        if rename:
+            data = data.rename(columns=rename)
+        data = data.dropna()  # To prevent errors processing matches.
+        if data.empty:
+            continue
+
+        data = score_candidates(data, features, exact=exact, workers=workers)
+        data = add_similarity_scores(data, 'name_id_orbis', 'name_id_gdelt', features['name_clean'],
+                                     workers=workers or -1, **sim_kwargs)
+        if survivors is not None:
+            data = pd.concat([survivors, data], ignore_index=True)
+        survivors = keep_top_k(data, k)
+
+    if survivors is None:
+        survivors = pd.DataFrame()
+    survivors = survivors.reset_index(drop=True)
+    if path:
+        survivors.to_parquet(path, index=False)
+    return survivors
@@ -0,0 +1,57 @@
+import os, sqlite3
+import pandas as pd
+
+curr_dir = os.path.dirname(os.path.realpath(__file__))
+journal_path = os.path.join(curr_dir, "journal.db")
+
+# Columns of logger.csv, in order
+COLUMNS = ["report", "tearsheet", "industry-report", "data-record-id", "name"]
+
+# Outcome at the end of the name of a record whose download did not finish in time.
+# Such a record is not done, the next run tries it again (see done_ids).
+TIMED_OUT = "download timed out"
+
+# Method to open the journal of downloaded records. SQLite in WAL mode lets several
+# workers append at the same time, and every record is committed as soon as it is written.
+def connect(path=journal_path):
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS records (
+                        record_id INTEGER PRIMARY KEY,
+                        report TEXT,
+                        tearsheet TEXT,
+                        industry_report TEXT,
+                        name TEXT)""")
+    return conn
+
+# Method to commit the outcome of one record (a row of the logger). A record that is
+# downloaded again replaces its earlier outcome.
+def add(conn, record):
+    conn.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                 (int(record["data-record-id"]), record["report"], record["tearsheet"], record["industry-report"], record["name"]))
+
+# Method to get the highest record id in the journal (None when empty), from the primary key index
+def last_id(conn):
+    return conn.execute("SELECT MAX(record_id) FROM records").fetchone()[0]
+
+# Method to get the ids of all records in the journal, except the ones whose download timed out
+def done_ids(conn):
+    return {row[0] for row in conn.execute("SELECT record_id FROM records WHERE name NOT LIKE ?", ("%-> " + TIMED_OUT,))}
+
+# Method to read the journal as a logger dataframe
+def to_frame(conn):
+    df = pd.read_sql_query("SELECT report, tearsheet, industry_report, record_id, name FROM records ORDER BY record_id", conn)
+    df.columns = COLUMNS
+    return df
+
+# Method to add the rows of an existing logger.csv (from before the journal) to the journal
+def import_logger(conn, path):
+    df = pd.read_csv(path)
+    df = df[df["data-record-id"] >= 0]
+    conn.execute("BEGIN")
+    rows = df[["data-record-id", "report", "tearsheet", "industry-report", "name"]].itertuples(index=False)
+    conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                     [(int(idx), *values) for idx, *values in rows])
+    conn.execute("COMMIT")
+    return len(df)
@@ -0,0 +1,193 @@
+import os, shutil, hashlib, argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pypdfium2 as pdfium
+
+curr_dir = os.path.dirname(os.path.realpath(__file__))
+cache_path = os.path.join(curr_dir, "pdf_cache")
+output_path = os.path.join(curr_dir, "pdf_pages.parquet")
+
+# Number of extraction processes, and of threads downloading for them. At most two
+# documents per process are held in memory at a time (downloading or being extracted).
+WORKERS = os.cpu_count() or 1
+DOWNLOADS = 8
+
+# Rows of the page table written at a time
+ROW_GROUP = 50_000
+
+PAGE_SCHEMA = pa.schema([("key", pa.string()), ("content_hash", pa.string()), ("page", pa.int32()), ("text", pa.string())])
+
+_client = None
+
+# Method to get the S3 client, created once and shared by all download threads
+def s3_client():
+    global _client
+    if _client is None:
+        import boto3
+        _client = boto3.client("s3")
+    return _client
+
+# Method to tell a local directory standing in for the S3 bucket from a bucket name
+def is_local(bucket):
+    return os.path.isdir(bucket)
+
+# Method to get the md5 of a local file, the same as the S3 ETag of a file uploaded in one part
+def file_hash(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+# Method to list the files of some folders of the bucket as (key, content hash) pairs.
+# The hash is the ETag for S3 and the md5 of the file for a local directory.
+def list_files(bucket, folders):
+    files = []
+    for folder in folders:
+        if is_local(bucket):
+            for dirpath, _, names in sorted(os.walk(os.path.join(bucket, folder))):
+                for name in sorted(names):
+                    path = os.path.join(dirpath, name)
+                    files.append((os.path.relpath(path, bucket).replace(os.sep, "/"), file_hash(path)))
+        else:
+            for page in s3_client().get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=folder):
+                files += [(obj["Key"], obj["ETag"].strip('"')) for obj in page.get("Contents", []) if not obj["Key"].endswith("/")]
+    return files
+
+# Method to read a file of the bucket into memory
+def fetch(bucket, key):
+    if is_local(bucket):
+        with open(os.path.join(bucket, key), "rb") as handle:
+            return handle.read()
+    return s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+
+# Method to get the cache file of a document
+def cache_file(cache_dir, content_hash):
+    return os.path.join(cache_dir, content_hash + ".parquet")
+
+# Method to get the text of every page of a pdf
+def extract_pages(data):
+    pdf = pdfium.PdfDocument(data)
+    try:
+        texts = []
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
+
+# Method run in the extraction processes: write the page text of one pdf to its cache file.
+# The file is written under a temporary name first so an interrupted run leaves no partial cache.
+def extract_to_cache(data, path):
+    texts = extract_pages(data)
+    table = pa.table({"page": pa.array(range(len(texts)), pa.int32()), "text": pa.array(texts, pa.string())})
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+    return len(texts)
+
+# Method to get the files whose content is not in the cache yet, one file per content hash
+def pending_files(files, cache_dir=cache_path):
+    todo = {}
+    for key, content_hash in files:
+        if content_hash not in todo and not os.path.exists(cache_file(cache_dir, content_hash)):
+            todo[content_hash] = key
+    return [(key, content_hash) for content_hash, key in todo.items()]
+
+# Method to extract the text of every file not in the cache yet. Downloads run in threads
+# and extraction in processes, so the next documents are downloaded while others are
+# extracted. Documents with the same content are extracted once.
+# Yields (key, error) for every extracted document, error is None when it worked.
+def extract_all(bucket, files, cache_dir=cache_path, workers=WORKERS, downloads=DOWNLOADS, in_flight=None):
+    os.makedirs(cache_dir, exist_ok=True)
+    in_flight = in_flight or 2 * workers
+    queue = deque(pending_files(files, cache_dir))
+
+    with ThreadPoolExecutor(downloads) as fetchers, ProcessPoolExecutor(workers) as extractors:
+        running = {}
+        while queue or running:
+            while queue and len(running) < in_flight:
+                key, content_hash = queue.popleft()
+                running[fetchers.submit(fetch, bucket, key)] = ("fetch", key, content_hash)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, key, content_hash = running.pop(future)
+                if future.exception() is not None:
+                    yield key, future.exception()
+                elif step == "fetch":
+                    future = extractors.submit(extract_to_cache, future.result(), cache_file(cache_dir, content_hash))
+                    running[future] = ("extract", key, content_hash)
+                else:
+                    yield key, None
+
+# Method to write the page text of the listed files, from the cache, to one parquet table
+# with the columns key, content_hash, page and text. Files without a cache file are left out.
+# Returns the number of pages written.
+def write_pages(files, cache_dir=cache_path, path=output_path):
+    writer = pq.ParquetWriter(path + ".tmp", PAGE_SCHEMA, compression="zstd", use_dictionary=["key", "content_hash"])
+    n_pages = 0
+    try:
+        batch = []
+        for key, content_hash in files:
+            cached = cache_file(cache_dir, content_hash)
+            if not os.path.exists(cached):
+                continue
+            pages = pq.read_table(cached)
+            n = pages.num_rows
+            batch.append(pa.table({"key": pa.array([key] * n, pa.string()),
+                                   "content_hash": pa.array([content_hash] * n, pa.string()),
+                                   "page": pages.column("page"), "text": pages.column("text")}, schema=PAGE_SCHEMA))
+            n_pages += n
+            if sum(t.num_rows for t in batch) >= ROW_GROUP:
+                writer.write_table(pa.concat_tables(batch))
+                batch = []
+        if batch:
+            writer.write_table(pa.concat_tables(batch))
+    finally:
+        writer.close()
+    os.replace(path + ".tmp", path)
+    return n_pages
+
+# Method to get the keys of the documents with a page containing a word (case insensitive)
+def find_documents(path, word):
+    table = pq.read_table(path, columns=["key", "text"])
+    mask = pc.match_substring(table.column("text"), word, ignore_case=True)
+    return sorted(set(table.filter(pc.fill_null(mask, False)).column("key").to_pylist()))
+
+# Method to copy documents of the bucket to another folder of it. S3 copies without downloading.
+def copy_files(bucket, keys, folder):
+    for key in keys:
+        dest = os.path.join(folder, os.path.basename(key))
+        if is_local(bucket):
+            os.makedirs(os.path.join(bucket, folder), exist_ok=True)
+            shutil.copyfile(os.path.join(bucket, key), os.path.join(bucket, dest))
+        else:
+            s3_client().copy_object(Bucket=bucket, Key=dest, CopySource={"Bucket": bucket, "Key": key})
+
+# Method to list, extract (what is not cached yet) and write the page table of some folders
+def run(bucket, folders, path=output_path, cache_dir=cache_path, workers=WORKERS):
+    files = list_files(bucket, folders)
+    print(f"{len(files)} files in {folders}")
+    failed = [(key, error) for key, error in extract_all(bucket, files, cache_dir, workers) if error is not None]
+    for key, error in failed:
+        print(f"Could not extract {key}: {error}")
+    print(f"{write_pages(files, cache_dir, path)} pages written to {path}")
+    return failed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Extract the page text of the pdf reports of a bucket (or of a local directory)")
+    parser.add_argument("bucket", help="S3 bucket, or a local directory laid out like it")
+    parser.add_argument("folders", nargs="+", help="folders (key prefixes) to process")
+    parser.add_argument("--output", default=output_path)
+    parser.add_argument("--cache", default=cache_path)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    run(args.bucket, args.folders, args.output, args.cache, args.workers)
@@ -1,176 +1,318 @@
 import time, os, re
-import pickle
-import pandas as pd
-from collections import defaultdict
+import multiprocessing as mp
 from fastprogress import progress_bar
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.firefox.options import Options
-from pathlib import Path
-from concat_entries import update_logger
-from selenium.common.exceptions import NoSuchElementException
+import journal
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
 curr_dir = os.path.dirname(os.path.realpath(__file__))
 dwn_path = os.path.join(curr_dir, "MSCI_Reports")
-logger_path = os.path.join(curr_dir, "logger.csv")
-records_path = os.path.join(curr_dir, "dwn_map.pkl")
+metrics_path = os.path.join(curr_dir, "metrics.csv")
 
-# Method to check if a download has finished or not
-def is_download_finished():
-    firefox_temp_file = sorted(Path(dwn_path).glob('*.part'))
-    downloaded_files = sorted(Path(dwn_path).glob('*.*'))
-    return len(firefox_temp_file) == 0 and len(downloaded_files) >= 1
+# ESG directory, and seconds to let its grid settle once the results are shown
+ESG_URL = "https://esgdirect.msci.com/"
+GRID_SETTLE = 10
 
-# Method to get name of downloaded file
-def getDownLoadedFileName():
-    driver.get("about:downloads")
-    return driver.execute_script("return document.querySelector('#contentAreaDownloadsView .downloadMainArea .downloadContainer description:nth-of-type(1)').value")
+# Number of Firefox workers. With more than one, every worker gets its own download
+# directory (MSCI_Reports/worker-<n>) and a disjoint range of the records still to download.
+WORKERS = 1
+
+# Seconds to wait for a download, and between two looks at the download directory
+DOWNLOAD_TIMEOUT = 300
+DOWNLOAD_POLL = 0.25
+
+# Height in px of a row of the grid, and seconds to wait for a row to be rendered after a jump
+ROW_HEIGHT = 33
+ROW_TIMEOUT = 30
+
+# Method to list the files in a download directory
+def snapshot(dwn_dir=dwn_path):
+    with os.scandir(dwn_dir) as entries:
+        return {entry.name for entry in entries}
+
+# Method to wait for the download started after the snapshot `before` was taken.
+# Firefox writes "<name>.part" (and an empty "<name>") while downloading and removes the
+# .part file when done, so the download is finished as soon as a new file has content and
+# no .part file. Only the entries that were not in `before` are looked at.
+# Returns the name of the downloaded file, or None after timeout seconds.
+def wait_for_download(dwn_dir=dwn_path, before=frozenset(), timeout=DOWNLOAD_TIMEOUT, poll=DOWNLOAD_POLL):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        new = snapshot(dwn_dir) - before
+        parts = {name[:-len(".part")] for name in new if name.endswith(".part")}
+        for name in new:
+            if name.endswith(".part") or name in parts:
+                continue
+            if os.path.getsize(os.path.join(dwn_dir, name)) > 0:
+                return name
+        time.sleep(poll)
+    return None
+
+# Columns of metrics.csv
+METRICS_COLUMNS = ["data-record-id", "worker", "report", "download_seconds", "record_seconds"]
+
+# Method to create metrics.csv with its header when it does not exist. Called by the parent
+# process only, before any worker starts, so the workers never race on the header.
+def init_metrics():
+    if not os.path.exists(metrics_path):
+        with open(metrics_path, "w") as handle:
+            handle.write(",".join(METRICS_COLUMNS) + "\n")
+
+# Method to append the timings of one record to metrics.csv, as one write of one line
+def log_metrics(metrics):
+    line = ",".join(str(metrics[key]) for key in METRICS_COLUMNS)
+    with open(metrics_path, "a") as handle:
+        handle.write(line + "\n")
+
+# Method to close every tab but the first (e.g. the one a report opened) and go back to the grid
+def close_tabs(driver):
+    handles = list(driver.window_handles)
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
 
 # Method to get total number of reports available in the page
 def getResults(driver):
     s = driver.find_element(By.XPATH, "//div[@id='tbtext-1070']").text
     return int(re.findall(r'\d+', s)[0])
 
+# Method to start a Firefox instance that saves downloads to dwn_dir
+def get_driver(dwn_dir=dwn_path):
+    firefox_options = Options()
+    firefox_options.set_preference("browser.download.alwaysOpenPanel", False)
+    firefox_options.set_preference("browser.download.folderList", 2)
+    firefox_options.set_preference("browser.download.dir", dwn_dir)
+    driver = webdriver.Firefox(options = firefox_options)
+    driver.maximize_window()
+    return driver
+
+# Method to open the ESG directory and wait until all results are loaded
+def open_grid(driver, delay=120):
+    driver.get(ESG_URL)
+    _ = WebDriverWait(driver, delay).until(EC.presence_of_element_located((By.ID, "tbtext-1070")))
+    time.sleep(GRID_SETTLE)
+    return getResults(driver)
+
+# Method to jump the grid straight to a record. The grid only renders the rows around its
+# scroll position, so set the position of the record and wait until its row is there.
+def scroll_to_record(driver, idx, timeout=ROW_TIMEOUT):
+    driver.execute_script('document.getElementById("gridview-1061").scrollTop = '+str(idx * ROW_HEIGHT))
+    WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, "//table[@data-recordindex="+str(idx)+"]")))
+
+# Method to get the index and company name of every row the grid has rendered, in one call
+def visible_records(driver):
+    rows = driver.execute_script('''
+        var tables = document.getElementById("gridview-1061").querySelectorAll("table[data-recordindex]");
+        return Array.prototype.map.call(tables, function(t) {
+            var span = t.querySelector("span");
+            return [parseInt(t.getAttribute("data-recordindex")), span ? span.textContent : ""];
+        });''')
+    return {int(idx): name for idx, name in rows}
+
+# Method to go through the record ids in order, a viewport at a time: jump to the first
+# record left, then yield (idx, company name) for all following ids that are rendered
+# around it. Only jumps again when the next id is not rendered any more.
+# A record whose row is not rendered within timeout is yielded with name None, so it is
+# logged as not found (see download_record), and the walk goes on with the next id.
+def walk_records(driver, ids, timeout=ROW_TIMEOUT):
+    ids = sorted(ids)
+    i = 0
+    while i < len(ids):
+        try:
+            scroll_to_record(driver, ids[i], timeout)
+        except TimeoutException:
+            yield ids[i], None
+            i += 1
+            continue
+        visible = visible_records(driver)
+        start = i
+        while i < len(ids) and ids[i] in visible:
+            # Clicking a row may make the grid re-render, check the next row is still there
+            if i > start and not driver.find_elements(By.XPATH, "//table[@data-recordindex="+str(ids[i])+"]"):
+                break
+            yield ids[i], visible[ids[i]]
+            i += 1
+
+# Method to download the esg report of one record, the grid has to be scrolled to it.
+# name is the company name when already read from the grid (see visible_records), None
+# to read it from the row. A record without a row is logged as not found, one without an ESG
+# report as found but report does not exist.
+# Returns the outcome as a row of the logger; timings go to metrics.csv. A download that does
+# not finish in DOWNLOAD_TIMEOUT is logged as journal.TIMED_OUT, and tried again by the next run.
+def download_record(driver, idx, dwn_dir=dwn_path, worker=0, name=None):
+    start = time.time()
+    download_seconds = ""
+    found = False
+    timed_out = False
+    comp_name = f"record {idx}"
+    try:
+        # Find the table row
+        table = driver.find_element(By.XPATH, "//table[@data-recordindex="+str(idx)+"]")
+
+        # Get the clickable link and the name of the company. Remove special characters to save as file name.
+        curr_row = table.find_element(By.XPATH, ".//span")
+        comp_name = " ".join(re.sub('[^A-Za-z0-9\s]+', '', curr_row.text if name is None else name).split())
+        rep_name = os.path.join(dwn_path,comp_name+" Report.pdf")
+        # The record is found once its row is there, whether or not it has an ESG report
+        found = True
+        curr_row.click()
+        time.sleep(1)
+        try:
+            report = driver.find_element(By.XPATH, "//*[text()='Download ESG Ratings Report']")
+            time.sleep(1)
+        except NoSuchElementException as e:
+            report = driver.find_element(By.XPATH, "//*[text()='Download Industry Report']")
+            time.sleep(1)
+            raise NoSuchElementException("no report")
+        before = snapshot(dwn_dir)
+        clicked = time.time()
+        try:
+            report.click()
+
+            # Wait until the download is finished and get the filename from the download directory
+            filename = wait_for_download(dwn_dir, before, DOWNLOAD_TIMEOUT)
+        finally:
+            # Close the tab the report opened, also when the download failed
+            close_tabs(driver)
+        if filename is None:
+            timed_out = True
+            raise TimeoutException(journal.TIMED_OUT)
+        download_seconds = round(time.time() - clicked, 2)
+        curr_name = os.path.join(dwn_dir,filename)
+
+        # As all reports are downloaded with generic name, rename it with the company's name
+        os.rename(curr_name, rep_name)
+        record = {"report": "Yes", "tearsheet": "No", "industry-report": "No", "data-record-id": idx, "name": comp_name}
+    except Exception as ee:
+        if timed_out:
+            comp_name = f"{comp_name} -> {journal.TIMED_OUT}"
+        elif found:
+            if "no report" in str(ee):
+                comp_name = f"{comp_name} -> found but report does not exist"
+            else:
+                comp_name = f"{comp_name} -> found but other error"
+        else:
+            comp_name = f"{comp_name} -> not found"
+        record = {"report": "No", "tearsheet": "No", "industry-report": "No", "data-record-id": idx, "name": comp_name}
+
+    log_metrics({"data-record-id": idx, "worker": worker, "report": record["report"],
+                 "download_seconds": download_seconds, "record_seconds": round(time.time() - start, 2)})
+    return record
+
 # Method to scroll on each record and download the esg report
 def download_reports(driver):
-    driver.get("https://esgdirect.msci.com/")
-    delay = 120
+    conn = journal.connect()
+    last_downloaded_id = -1
+    init_metrics()
 
     try:
-        # Wait until all results are loaded
-        _ = WebDriverWait(driver, delay).until(EC.presence_of_element_located((By.ID, "tbtext-1070")))
-        time.sleep(10)
-        results = getResults(driver)
-        dwn_map = defaultdict(list)
-        last_id = -1 
-        df = pd.read_csv(logger_path)
-        df.drop(columns=["Unnamed: 0"], inplace=True)
-        max_id = max(df["data-record-id"])
-        last_id = 0 if max_id < 0 else max_id
-        curr_id = 0 if max_id < 0 else last_id + 1
-
-        
-        scroll_len = last_id * 33
-
-        # Scroll to the report that needs to be downloaded
-        driver.execute_script('document.getElementById("gridview-1061").scrollTop = 0')
-        driver.execute_script('document.getElementById("gridview-1061").scrollTop += '+str(scroll_len))
-        sleep_time = (last_id // 500)*3
-        time.sleep(sleep_time)
-
-        # Assert that the when error was encountered, we restart from last id
-        if last_id > 0:
-            prev_dwn_map = None
-            with open("dwn_map.pkl", "rb") as handle:
-                prev_dwn_map = pickle.load(handle)
-            prev_last_id = max(prev_dwn_map["data-record-id"])
-            assert last_id == prev_last_id
-
-        print(f"Starting from idx = {curr_id}")
-        last_downloaded_id = -1
-
-        for idx in progress_bar(range(curr_id, results)):
-            
-            add_scroll = 0 if idx == 0 else 33
-            driver.execute_script('document.getElementById("gridview-1061").scrollTop += '+str(add_scroll))
-            time.sleep(2)
-            found = False
-            try:
-                # Find the table row
-                table = driver.find_element(By.XPATH, "//table[@data-recordindex="+str(idx)+"]")
-
-                # Get the clickable link and the name of the company. Remove special characters to save as file name.
-                curr_row = table.find_element(By.XPATH, ".//span")
-                comp_name = " ".join(re.sub('[^A-Za-z0-9\s]+', '', curr_row.text).split())
-                rep_name = os.path.join(dwn_path,comp_name+" Report.pdf")
-                curr_row.click()
-                time.sleep(1)
-                try:
-                    report = driver.find_element(By.XPATH, "//*[text()='Download ESG Ratings Report']")
-                    found = True
-                    time.sleep(1)
-                except NoSuchElementException as e:
-                    report = driver.find_element(By.XPATH, "//*[text()='Download Industry Report']")
-                    time.sleep(1)
-                    raise NoSuchElementException("no report")
-                report.click()
-                time.sleep(10)
-
-                # Wait until download is finished, once done, break and get the filename
-                for _ in range(100):
-                    if is_download_finished():
-                        handles = list(driver.window_handles)
-                        driver.switch_to.window(handles[1])
-                        break
-                    time.sleep(3)
-                filename = getDownLoadedFileName()
-                if filename is not None:
-                    curr_name = os.path.join(dwn_path,filename)
-                else:
-                    raise NoSuchElementException("no report")
-                driver.close()
-                handles = list(driver.window_handles)
-                assert len(handles) == 1
-                driver.switch_to.window(handles[0])
-
-                # As all reports are downloaded with generic name, rename it with the company's name
-                os.rename(curr_name, rep_name)
-                dwn_map["report"].append("Yes")
-                dwn_map["tearsheet"].append("No")
-                dwn_map["industry-report"].append("No")                
-                dwn_map["data-record-id"].append(idx)
-                dwn_map["name"].append(comp_name)
-            except Exception as ee:
-                dwn_map["report"].append("No")
-                dwn_map["tearsheet"].append("No")
-                dwn_map["industry-report"].append("No")                
-                dwn_map["data-record-id"].append(idx)
-                if found:
-                    if "no report" in str(ee):
-                        dwn_map["name"].append(f"{comp_name} -> found but report does not exist")
-                    else:
-                        dwn_map["name"].append(f"{comp_name} -> found but other error")
-                else:
-                    dwn_map["name"].append(f"{comp_name} -> not found")
-
-            # Create a checkpoint in dwn_map.pkl for every 7 records downloaded
+        results = open_grid(driver)
+
+        # Resume with the records not in the journal yet, and the ones whose download timed out
+        done = journal.done_ids(conn)
+        ids = [idx for idx in range(results) if idx not in done]
+        print(f"Starting from idx = {ids[0] if ids else results}")
+
+        # Jump straight to the record and download every rendered row before jumping again
+        for idx, name in progress_bar(walk_records(driver, ids, ROW_TIMEOUT), total=len(ids)):
+
+            # Every outcome is committed to the journal as soon as the record is done
+            journal.add(conn, download_record(driver, idx, dwn_path, name=name))
             last_downloaded_id = idx
-            if idx > curr_id and idx%7 == 0:
-                with open(records_path, 'wb') as handle:
-                    pickle.dump(dwn_map, handle, protocol=pickle.HIGHEST_PROTOCOL)
-                print(f"Checkpoint saved at idx = {idx}")
-            time.sleep(2)
 
         return True
 
-    # For any unknown exception, print it and create a checkpoint too.
+    # For any unknown exception, print it. Everything up to the failure is in the journal.
     except Exception as e:
         print(e)
-        if dwn_map is not None and "data-record-id" in dwn_map and len(dwn_map["data-record-id"]) > 0:
-            with open(records_path, 'wb') as handle:
-                pickle.dump(dwn_map, handle, protocol=pickle.HIGHEST_PROTOCOL)
         print(f"Failed at id = {last_downloaded_id}")
         return False
-            
+    finally:
+        conn.close()
 
-if __name__ == "__main__":
+# Method to split the ids still to download into n disjoint, contiguous ranges
+def partition_ids(ids, n):
+    ids = sorted(ids)
+    size = -(-len(ids) // n) if ids else 0
+    return [ids[i:i + size] for i in range(0, len(ids), size)] if size else []
 
-    # Set firefox options and download directory to MSCI_Reports/
-    firefox_options = Options()
-    firefox_options.set_preference("browser.download.alwaysOpenPanel", False)
-    firefox_options.set_preference("browser.download.folderList", 2)
-    firefox_options.set_preference("browser.download.dir", dwn_path)
-    successfully_updated = True
-    while successfully_updated:
-        driver = webdriver.Firefox(options = firefox_options)
-        driver.maximize_window()
-        status_complete = download_reports(driver)
-        if status_complete:
-            break 
+# Method run by every worker process: its own Firefox and download directory, and one
+# range of record ids. Every outcome is committed to the shared journal and its id put on
+# the queue for the progress bar, None when the worker stops.
+def download_worker(worker_id, ids, queue):
+    dwn_dir = os.path.join(dwn_path, f"worker-{worker_id}")
+    os.makedirs(dwn_dir, exist_ok=True)
+    conn = journal.connect()
+    driver = None
+    try:
+        driver = get_driver(dwn_dir)
+        open_grid(driver)
+        for idx, name in walk_records(driver, ids, ROW_TIMEOUT):
+            journal.add(conn, download_record(driver, idx, dwn_dir, worker_id, name))
+            queue.put(idx)
+    except Exception as e:
+        print(f"Worker {worker_id} stopped: {e}")
+    finally:
+        if driver is not None:
+            driver.quit()
+        conn.close()
+        queue.put(None)
+
+# Method to download the reports with several Firefox workers, all writing to the journal.
+# Records a worker did not get to stay pending for the next run.
+def download_reports_pool(workers=WORKERS):
+    driver = get_driver()
+    try:
+        results = open_grid(driver)
+    finally:
         driver.quit()
-        time.sleep(3)
 
-        # If error encountered, status will be false so update CSV files with latest checkpoint
-        successfully_updated = update_logger()
\ No newline at end of file
+    conn = journal.connect()
+    done = journal.done_ids(conn)
+    conn.close()
+    pending = [idx for idx in range(results) if idx not in done]
+    ranges = partition_ids(pending, workers)
+    print(f"{len(pending)} records to download with {len(ranges)} workers")
+    init_metrics()
+
+    queue = mp.Queue()
+    procs = [mp.Process(target=download_worker, args=(i, ids, queue)) for i, ids in enumerate(ranges)]
+    for p in procs:
+        p.start()
+
+    # Follow the progress until every worker has stopped
+    def finished():
+        running = len(procs)
+        while running:
+            idx = queue.get()
+            if idx is None:
+                running -= 1
+            else:
+                yield idx
+
+    n_done = sum(1 for _ in progress_bar(finished(), total=len(pending)))
+    for p in procs:
+        p.join()
+    return n_done == len(pending)
+
+
+if __name__ == "__main__":
+
+    if WORKERS > 1:
+        download_reports_pool(WORKERS)
+    else:
+        while True:
+            # Set firefox options and download directory to MSCI_Reports/
+            driver = get_driver()
+            status_complete = download_reports(driver)
+            driver.quit()
+            if status_complete:
+                break
+
+            # If error encountered, status will be false; restart from the journal
+            time.sleep(3)
@@ -0,0 +1,82 @@
+import os
+
+import pyarrow.parquet as pq
+import pytest
+
+pytest.importorskip("pypdfium2")
+
+import pdf_pipeline
+
+
+# Method to write a small pdf with one line of text (Helvetica) on every page
+def make_pdf(texts):
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in texts:
+        stream = b"BT /F1 12 Tf 72 720 Td (" + text.encode("latin-1") + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(kids) + b"] /Count %d >>" % len(texts)
+
+    data, offsets = b"%PDF-1.4\n", []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    return data + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    # Local directory laid out like the bucket: two folders, a copy of a report and a broken file
+    root = tmp_path / "bucket"
+    for key, data in {
+        "2022/Acme Corp Report.pdf": make_pdf(["Acme carbon emissions", "Acme board"]),
+        "2022/Globex Inc Report.pdf": make_pdf(["Globex water use"]),
+        "2023/Acme Corp Report.pdf": make_pdf(["Acme carbon emissions", "Acme board"]),
+        "2023/Initech Report.pdf": b"<html>not a pdf</html>",
+    }.items():
+        (root / key).parent.mkdir(parents=True, exist_ok=True)
+        (root / key).write_bytes(data)
+    return str(root)
+
+
+def test_pipeline_with_a_local_bucket(bucket, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    output = str(tmp_path / "pages.parquet")
+
+    # The broken file is reported, the others are extracted by the pool all the same
+    failed = pdf_pipeline.run(bucket, ["2022", "2023"], output, cache_dir, workers=2)
+    assert [key for key, _ in failed] == ["2023/Initech Report.pdf"]
+
+    table = pq.read_table(output).to_pandas()
+    assert list(table.columns) == ["key", "content_hash", "page", "text"]
+    pages = {(key, page): text.strip() for key, page, text in zip(table["key"], table["page"], table["text"])}
+    assert pages == {
+        ("2022/Acme Corp Report.pdf", 0): "Acme carbon emissions",
+        ("2022/Acme Corp Report.pdf", 1): "Acme board",
+        ("2022/Globex Inc Report.pdf", 0): "Globex water use",
+        ("2023/Acme Corp Report.pdf", 0): "Acme carbon emissions",
+        ("2023/Acme Corp Report.pdf", 1): "Acme board",
+    }
+
+    # Both copies of the Acme report share one cache file, under their content hash
+    files = dict(pdf_pipeline.list_files(bucket, ["2022", "2023"]))
+    acme = files["2022/Acme Corp Report.pdf"]
+    assert files["2023/Acme Corp Report.pdf"] == acme
+    assert sorted(os.listdir(cache_dir)) == sorted(pdf_pipeline.cache_file("", h) for h in {acme, files["2022/Globex Inc Report.pdf"]})
+    assert set(table.loc[table["key"].str.contains("Acme"), "content_hash"]) == {acme}
+
+    # A second run only goes back to the file that could not be extracted
+    mtimes = {name: os.path.getmtime(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)}
+    files = pdf_pipeline.list_files(bucket, ["2022", "2023"])
+    assert [key for key, _ in pdf_pipeline.pending_files(files, cache_dir)] == ["2023/Initech Report.pdf"]
+    rerun = list(pdf_pipeline.extract_all(bucket, files, cache_dir, workers=2))
+    assert [key for key, error in rerun] == ["2023/Initech Report.pdf"] and rerun[0][1] is not None
+    assert {name: os.path.getmtime(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)} == mtimes
+
+    assert pdf_pipeline.find_documents(output, "CARBON") == ["2022/Acme Corp Report.pdf", "2023/Acme Corp Report.pdf"]
@@ -0,0 +1,133 @@
+import functools
+import os
+import queue
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("selenium")
+pytest.importorskip("fastprogress")
+from selenium.common.exceptions import WebDriverException
+
+import journal
+import scrape_reports
+
+SITE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "test_esg_site")
+
+# Outcome of every record of the mock page (see COMPANIES in test_esg_site/index.html):
+# Hooli (4) is never rendered, so it is only known by its record id
+EXPECTED = {
+    0: ("Yes", "Acme Corp"),
+    1: ("Yes", "Globex Inc"),
+    2: ("No", "Initech -> found but report does not exist"),
+    3: ("Yes", "Umbrella Holdings"),
+    4: ("No", "record 4 -> not found"),
+    5: ("Yes", "Stark Sons"),
+    6: ("Yes", "Wayne Enterprises"),
+    7: ("No", "Vandelay Industries -> " + journal.TIMED_OUT),
+}
+
+
+# Method to serve the fixture directory: PDFs come as attachments, like the reports of the
+# ESG directory, and slow.pdf sends its headers and then nothing until the server stops
+def make_handler(stop):
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.endswith("slow.pdf"):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Disposition", 'attachment; filename="report.pdf"')
+                self.send_header("Content-Length", "100000")
+                self.end_headers()
+                stop.wait()
+                return
+            super().do_GET()
+
+        def end_headers(self):
+            if self.path.endswith(".pdf"):
+                self.send_header("Content-Disposition", 'attachment; filename="report.pdf"')
+            super().end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return functools.partial(Handler, directory=SITE_DIR)
+
+
+@pytest.fixture
+def esg_site(tmp_path, monkeypatch):
+    stop = threading.Event()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(stop))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Point the scraper, its journal and its metrics at the mock page and tmp_path
+    dwn_dir = tmp_path / "MSCI_Reports"
+    dwn_dir.mkdir()
+    monkeypatch.setattr(scrape_reports, "ESG_URL", f"http://127.0.0.1:{server.server_port}/index.html")
+    monkeypatch.setattr(scrape_reports, "GRID_SETTLE", 0)
+    monkeypatch.setattr(scrape_reports, "ROW_TIMEOUT", 3)
+    monkeypatch.setattr(scrape_reports, "DOWNLOAD_TIMEOUT", 5)
+    monkeypatch.setattr(scrape_reports, "dwn_path", str(dwn_dir))
+    monkeypatch.setattr(scrape_reports, "metrics_path", str(tmp_path / "metrics.csv"))
+    monkeypatch.setattr(journal, "connect", functools.partial(journal.connect, str(tmp_path / "journal.db")))
+    monkeypatch.setenv("MOZ_HEADLESS", "1")
+    yield dwn_dir
+
+    stop.set()
+    server.shutdown()
+    server.server_close()
+
+
+# Method to start Firefox, or skip the test where it is not installed
+def firefox(dwn_dir):
+    try:
+        return scrape_reports.get_driver(str(dwn_dir))
+    except WebDriverException as e:
+        pytest.skip(f"Firefox is not available: {e.msg}")
+
+
+# Method to check the journal, the renamed reports and metrics.csv against EXPECTED
+def check_outcomes(dwn_dir, metrics_path):
+    conn = journal.connect()
+    df = journal.to_frame(conn)
+    assert dict(zip(df["data-record-id"], zip(df["report"], df["name"]))) == EXPECTED
+    assert journal.done_ids(conn) == set(EXPECTED) - {7}
+    conn.close()
+
+    with open(os.path.join(SITE_DIR, "report.pdf"), "rb") as handle:
+        pdf = handle.read()
+    for report, name in EXPECTED.values():
+        path = os.path.join(dwn_dir, name + " Report.pdf")
+        assert os.path.exists(path) == (report == "Yes")
+        if report == "Yes":
+            with open(path, "rb") as handle:
+                assert handle.read() == pdf
+
+    with open(metrics_path) as handle:
+        lines = handle.read().splitlines()
+    assert lines[0] == ",".join(scrape_reports.METRICS_COLUMNS)
+    assert sorted(int(line.split(",")[0]) for line in lines[1:]) == sorted(EXPECTED)
+
+
+def test_download_reports(esg_site):
+    driver = firefox(esg_site)
+    try:
+        assert scrape_reports.download_reports(driver)
+        assert len(driver.window_handles) == 1
+    finally:
+        driver.quit()
+    check_outcomes(esg_site, scrape_reports.metrics_path)
+
+
+def test_download_worker(esg_site):
+    firefox(esg_site).quit()
+    scrape_reports.init_metrics()
+    progress = queue.Queue()
+    scrape_reports.download_worker(0, sorted(EXPECTED), progress)
+
+    ids = [progress.get() for _ in range(len(EXPECTED) + 1)]
+    assert ids[:-1] == sorted(EXPECTED) and ids[-1] is None
+    # Reports are renamed into the main download directory, whatever the worker
+    check_outcomes(esg_site, scrape_reports.metrics_path)
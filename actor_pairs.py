@@ -0,0 +1,84 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Actor codes used in the GDELT EVENTS notebooks
+ACTOR_CODES = [
+    'COP', 'GOV', 'INS', 'JUD', 'MIL', 'OPP', 'REB', 'SEP', 'SPY', 'UAF', 'AGR',
+    'BUS', 'CRM', 'CVL', 'DEV', 'EDU', 'ELI', 'ENV', 'HLH', 'HRI', 'LAB', 'LEG',
+    'MED', 'REF', 'MAD', 'RAD', 'IGO', 'IMG', 'INT', 'MNC', 'NGM', 'NGO', 'UIS',
+]
+
+# An actor pair spec maps a direction name to (Actor1 codes, Actor2 codes).
+# Rows are tagged with the first direction they match, in the order of the spec.
+BUS_LAB = {
+    "bus_lab": (["BUS", "MNC"], ["LAB"]),
+    "lab_bus": (["LAB"], ["BUS", "MNC"]),
+}
+
+# Every event between two of the ACTOR_CODES, in any direction
+ALL_ACTORS = {
+    "all": (ACTOR_CODES, ACTOR_CODES),
+}
+
+CODE_PATTERN = re.compile(r"^[A-Za-z0-9]+$")
+
+
+# Method to get the quoted "IN (...)" list of a group of codes
+def sql_in(codes):
+    for code in codes:
+        if not CODE_PATTERN.match(code):
+            raise ValueError(f"Not a valid actor code: {code!r}")
+    return "(" + ", ".join(f"'{code}'" for code in codes) + ")"
+
+
+# Method to compile a spec into one query for one partition (year).
+# The WHERE clause keeps plain IN lists on Actor1Code/Actor2Code so the server can use
+# its indexes, and a CASE column tags every row with its direction, so all directions
+# come out of a single scan instead of one query each.
+def compile_query(pairs, year, table="gdelt_events", columns="*", direction_col="direction"):
+    conditions = {
+        name: f"(Actor1Code IN {sql_in(actor1)} AND Actor2Code IN {sql_in(actor2)})"
+        for name, (actor1, actor2) in pairs.items()
+    }
+    all_actor1 = list(dict.fromkeys(code for actor1, _ in pairs.values() for code in actor1))
+    all_actor2 = list(dict.fromkeys(code for _, actor2 in pairs.values() for code in actor2))
+    case = " ".join(f"WHEN {cond} THEN '{name}'" for name, cond in conditions.items())
+    return (
+        f"SELECT {columns}, CASE {case} END AS {direction_col} FROM {table} "
+        f"WHERE Year = {int(year)} "
+        f"AND Actor1Code IN {sql_in(all_actor1)} AND Actor2Code IN {sql_in(all_actor2)} "
+        f"AND ({' OR '.join(conditions.values())});"
+    )
+
+
+# Method to look up, for every row, whether its code is in a group.
+# The column is turned into a categorical so the check is done once per distinct code
+# and then spread over the rows with the integer codes. Matching is case insensitive
+# like LIKE/IN on the server (e.g. 'mnc' matches MNC).
+def in_group(col, codes):
+    cat = col.astype("category").cat
+    lookup = np.append(cat.categories.str.upper().isin([c.upper() for c in codes]), False)
+    return lookup[cat.codes.to_numpy()]
+
+
+# Method to apply a spec to an already loaded frame.
+# Returns the matching rows with a categorical direction column.
+def filter_frame(df, pairs, direction_col="direction"):
+    direction = np.full(len(df), -1, dtype="int8")
+    for i, (actor1, actor2) in enumerate(pairs.values()):
+        match = in_group(df["Actor1Code"], actor1) & in_group(df["Actor2Code"], actor2)
+        direction[(direction == -1) & match] = i
+    keep = direction >= 0
+    df = df[keep].copy()
+    df[direction_col] = pd.Categorical.from_codes(direction[keep], categories=list(pairs))
+    return df
+
+
+# Method to split a tagged frame into one frame per direction
+def split_directions(df, pairs, direction_col="direction"):
+    return {
+        name: df[df[direction_col] == name].drop(columns=direction_col).reset_index(drop=True)
+        for name in pairs
+    }
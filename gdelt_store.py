@@ -0,0 +1,181 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from prio_grid import N_COLS, lat_long_to_gid
+
+# Store of GDELT events shared by the GDELT EVENTS notebooks: Parquet partitioned by year
+# (<path>/Year=YYYY/*.parquet, the same layout hpcc_extract writes) with the fixed types of
+# SCHEMA, so a read only loads the columns and years it asks for.
+EVENTS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'gdelt_events')
+
+# Types of the known event columns, other columns keep the type they come with.
+# Codes are dictionary encoded (categoricals in pandas), SQLDATE is the yyyymmdd int and
+# gid the PRIO GRID cell of ActionGeo, null where the coordinates are not valid.
+# GoldsteinScale and AvgTone stay float64 so means come out the same as from the CSVs.
+CODE = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = {
+    'GLOBALEVENTID': pa.int64(),
+    'SQLDATE': pa.int32(),
+    'Actor1Code': CODE,
+    'Actor2Code': CODE,
+    'Actor1CountryCode': CODE,
+    'Actor2CountryCode': CODE,
+    'ActionGeo_CountryCode': CODE,
+    'direction': CODE,
+    'GoldsteinScale': pa.float64(),
+    'AvgTone': pa.float64(),
+    'ActionGeo_Lat': pa.float32(),
+    'ActionGeo_Long': pa.float32(),
+    'gid': pa.int32(),
+}
+
+# Columns not stored but worked out by read_events: year (from the partition) and the PRIO
+# GRID cell centre pg_lat / pg_long (from gid). Any of these in the input is dropped.
+DERIVED = ['year', 'pg_lat', 'pg_long']
+
+# Rows of a CSV converted at a time
+CHUNKSIZE = 1_000_000
+
+
+# Method to cast a column to its store type. Codes are decoded to strings first, so codes
+# read as numbers or all NULL still end up dictionary encoded.
+def cast_column(column, type):
+    if column.type == type:
+        return column
+    if pa.types.is_dictionary(type):
+        return pc.cast(column, pa.string()).dictionary_encode().cast(type)
+    return pc.cast(column, type)
+
+
+# Method to add the gid column to a table, from the full precision coordinates
+def add_gid(table, spine_gids=None):
+    lat = pc.cast(table.column('ActionGeo_Lat'), pa.float64()).to_numpy()
+    long = pc.cast(table.column('ActionGeo_Long'), pa.float64()).to_numpy()
+    gid, valid = lat_long_to_gid(lat, long, spine_gids)
+    return table.append_column('gid', pa.array(gid.astype('int32'), mask=~valid))
+
+
+# Method to give a table of events the store types. gid is added when it is missing and the
+# coordinates are there (before they are cast to float32).
+def conform(table, spine_gids=None):
+    table = table.drop_columns([name for name in DERIVED if name in table.column_names])
+    if 'gid' not in table.column_names and {'ActionGeo_Lat', 'ActionGeo_Long'} <= set(table.column_names):
+        table = add_gid(table, spine_gids)
+    for i, name in enumerate(table.column_names):
+        if name in SCHEMA:
+            table = table.set_column(i, name, cast_column(table.column(name), SCHEMA[name]))
+    return table
+
+
+# Method to turn a frame of events into a table of the store. gid is always computed again
+# (only the cells of the spine are kept if spine_gids is given) and Year is left to the partition.
+def to_table(df, spine_gids=None):
+    df = df.drop(columns=[name for name in ['gid', 'Year'] if name in df.columns])
+    return conform(pa.Table.from_pandas(df, preserve_index=False), spine_gids)
+
+
+# Method to write frames of events as the store. The year of an event is taken from SQLDATE,
+# or from a Year column when there is no SQLDATE. The store is built next to path and moved
+# there when complete. Returns the number of events written.
+def write_events(frames, path=EVENTS_PATH, spine_gids=None):
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    n_rows = 0
+    for i, df in enumerate(frames):
+        year = df['SQLDATE'] // 10000 if 'SQLDATE' in df.columns else df['Year']
+        table = to_table(df, spine_gids).append_column('Year', pa.array(np.asarray(year, dtype='int32')))
+        pq.write_to_dataset(table, tmp, partition_cols=['Year'], basename_template=f'part-{i:05d}-{{i}}.parquet',
+                            existing_data_behavior='overwrite_or_ignore', compression='zstd')
+        n_rows += table.num_rows
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return n_rows
+
+
+# Method to convert event CSVs (e.g. the yearly data/*.csv) to the store, a chunk at a time
+def convert_csv(paths, path=EVENTS_PATH, chunksize=CHUNKSIZE, spine_gids=None):
+    chunks = (chunk for csv in paths for chunk in pd.read_csv(csv, chunksize=chunksize))
+    return write_events(chunks, path, spine_gids)
+
+
+# Method to list the year partitions of a store as {year: directory}, only the given years if given.
+# path can also be a single partition directory.
+def year_partitions(path=EVENTS_PATH, years=None):
+    if os.path.basename(os.path.normpath(path)).startswith('Year='):
+        partitions = {int(os.path.basename(os.path.normpath(path))[5:]): path}
+    else:
+        partitions = {int(name[5:]): os.path.join(path, name) for name in os.listdir(path) if name.startswith('Year=')}
+    return {year: partitions[year] for year in sorted(partitions) if years is None or year in years}
+
+
+# Method to read one file of the store, memory mapped and only the columns needed for
+# columns (all if None). Files written before the store types (e.g. older query caches)
+# are conformed on the way, their gid is computed from the coordinates.
+# With actor_codes, only the events with both actors in actor_codes are kept.
+def read_file(file, year, columns=None, actor_codes=None):
+    names = pq.read_schema(file).names
+    if columns is None:
+        columns = names + (['gid'] if 'gid' not in names else []) + ['Year']
+    stored = [name for name in columns if name not in DERIVED + ['Year']]
+    if {'pg_lat', 'pg_long'} & set(columns):
+        stored.append('gid')
+    if 'gid' in stored and 'gid' not in names:
+        stored += ['ActionGeo_Lat', 'ActionGeo_Long']
+    if actor_codes is not None:
+        stored += ['Actor1Code', 'Actor2Code']
+    stored = [name for name in dict.fromkeys(stored) if name in names]
+
+    table = conform(pq.read_table(file, columns=stored, memory_map=True))
+    if actor_codes is not None:
+        codes = pa.array(list(actor_codes), pa.string())
+        table = table.filter(pc.and_(pc.is_in(table.column('Actor1Code'), value_set=codes),
+                                     pc.is_in(table.column('Actor2Code'), value_set=codes)))
+    if 'Year' in columns or 'year' in columns:
+        table = table.append_column('Year', pa.array(np.full(table.num_rows, year, dtype='int32')))
+    return table
+
+
+# Method to give the derived columns to a frame read from the store and put the columns in order
+def finish(df, columns=None):
+    if 'Year' in df.columns:
+        df['Year'] = df['Year'].astype('int64')
+        df['year'] = df['Year']
+    if 'gid' in df.columns:
+        df['gid'] = df['gid'].astype('Int32')
+        gid = df['gid'].to_numpy(dtype='float64', na_value=np.nan) - 1
+        df['pg_lat'] = np.floor(gid / N_COLS) / 2 - 89.75
+        df['pg_long'] = np.mod(gid, N_COLS) / 2 - 179.75
+    if columns is None:
+        return df.drop(columns=[name for name in DERIVED if name in df.columns])
+    return df[[name for name in columns if name in df.columns]]
+
+
+# Method to go through the store a file at a time (a chunk of at most one year), as frames with
+# only the given columns / years / actors (see read_file). Keeps memory to one file.
+def iter_events(path=EVENTS_PATH, columns=None, years=None, actor_codes=None):
+    for year, directory in year_partitions(path, years).items():
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.parquet'):
+                table = read_file(os.path.join(directory, name), year, columns, actor_codes)
+                yield finish(table.to_pandas(), columns)
+
+
+# Method to read events from the store into one frame: only the given columns (stored or
+# derived: year, pg_lat, pg_long), years and actors. Codes come out as categoricals.
+def read_events(path=EVENTS_PATH, columns=None, years=None, actor_codes=None):
+    tables = [read_file(os.path.join(directory, name), year, columns, actor_codes)
+              for year, directory in year_partitions(path, years).items()
+              for name in sorted(os.listdir(directory)) if name.endswith('.parquet')]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    table = pa.concat_tables(tables, promote_options='permissive')
+    return finish(table.to_pandas(), columns)
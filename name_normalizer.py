@@ -0,0 +1,82 @@
+import functools
+import re
+import string
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from cleanco import basename
+
+# Patterns are compiled once at import instead of on every call
+PARENTHESIS = re.compile(r'\(.*\)')
+PUNCTUATION = str.maketrans('', '', string.punctuation)
+DASHES = re.compile(r'[-]')
+MARKERS = re.compile(r'\(\*\)|\(#\)')
+SPACES = re.compile(r'\s+')
+NON_ALNUM = re.compile(r'[^0-9a-zA-Z\s-]')
+
+# Results of earlier calls are kept per cleaning function, at most MEMO_SIZE of them (least
+# recently used dropped first): {function name: lru_cache wrapped function}
+MEMO_SIZE = 1_000_000
+MEMO = {}
+
+
+# Method to clean a company name (Orbis / GDELT organizations, see SP Global Export Data/fuzzy_matching.py):
+# lower case, strip, remove anything in parenthesis and all punctuation, remove company
+# suffixes with cleanco (twice, because of multiple suffixes) and extra whitespace
+def company_name(name):
+    name = name.lower().strip()
+    name = PARENTHESIS.sub('', name)
+    name = name.translate(PUNCTUATION)
+    name = basename(basename(name))
+    return ' '.join(name.split())
+
+
+# Method to clean a World Heritage site name (see World Heritage tentative sites pt. 2/tentative_list.ipynb)
+def heritage_name(name):
+    name = DASHES.sub(' ', name)
+    name = MARKERS.sub('', name)
+    name = name.strip()
+    name = SPACES.sub(' ', name)
+    name = NON_ALNUM.sub('', name)
+    return name.title()
+
+
+def _apply(args):
+    func, values = args
+    return [func(v) for v in values]
+
+
+# Method to get the memoized version of a cleaning function (see MEMO)
+def memoized(func):
+    if func.__name__ not in MEMO:
+        MEMO[func.__name__] = functools.lru_cache(maxsize=MEMO_SIZE)(func)
+    return MEMO[func.__name__]
+
+
+# Method to clean a whole column with one of the functions above.
+# Every distinct value is cleaned only once. With workers > 1 (and more than chunksize
+# distinct values) the distinct values are split over a process pool, otherwise values
+# cleaned by earlier calls are taken from MEMO (memo=True).
+# Returns a Series aligned with values (NaN stays NaN).
+def normalize(values, func=company_name, workers=1, memo=True, chunksize=10_000):
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    uniques = [str(u) for u in uniques]
+
+    if workers > 1 and len(uniques) > chunksize:
+        chunks = [(func, uniques[i:i + chunksize]) for i in range(0, len(uniques), chunksize)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            done = [clean for part in pool.map(_apply, chunks) for clean in part]
+    else:
+        done = _apply((memoized(func) if memo else func, uniques))
+
+    cleaned = np.array(done + [np.nan], dtype=object)
+    return pd.Series(cleaned[codes], index=values.index, name=values.name)
+
+
+# Method to empty the memo cache
+def clear_memo():
+    for func in MEMO.values():
+        func.cache_clear()
+    MEMO.clear()
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# PRIO GRID is a 0.5 x 0.5 degree grid. Cells are numbered from 1 starting at the
+# south-west corner (lat -89.75, lon -179.75), going east along a row of 720 cells
+# and then north row by row, so gid = row * 720 + col + 1.
+N_ROWS = 360
+N_COLS = 720
+
+
+# Method to round coordinates to the PRIO GRID cell centres (.25 / .75).
+# Same rules as the old lat_long_to_PG_lat_long loop: the fractional part is taken
+# with Python's % (always >= 0) and "<= 0.5" goes to the lower half, also for
+# negative coordinates, so e.g. -0.5 -> -0.75 and -1.0 -> -1.75.
+def to_pg_center(x):
+    x = np.asarray(x, dtype="float64")
+    whole = np.trunc(x)
+    lower = np.mod(x, 1) <= 0.5
+    pos = np.where(lower, 0.25, 0.75)
+    neg = np.where(lower, -0.75, -0.25)
+    return whole + np.where(x >= 0, pos, neg)
+
+
+# Method to turn cell centres into PRIO GRID gids.
+# Returns the gid array (-1 where the cell is not valid) and a boolean validity mask.
+# A coordinate is not valid if it is NaN or falls outside the grid; if spine_gids is
+# given, cells missing from the spine are not valid either (same as the old left merge).
+def center_to_gid(pg_lat, pg_long, spine_gids=None):
+    pg_lat = np.asarray(pg_lat, dtype="float64")
+    pg_long = np.asarray(pg_long, dtype="float64")
+    valid = np.isfinite(pg_lat) & np.isfinite(pg_long)
+    row = np.floor((np.where(valid, pg_lat, 0) + 90) * 2)
+    col = np.floor((np.where(valid, pg_long, 0) + 180) * 2)
+    valid &= (row >= 0) & (row < N_ROWS) & (col >= 0) & (col < N_COLS)
+    gid = np.where(valid, row * N_COLS + col + 1, -1).astype("int64")
+    if spine_gids is not None:
+        valid &= np.isin(gid, np.asarray(spine_gids, dtype="int64"))
+        gid[~valid] = -1
+    return gid, valid
+
+
+# Method to get PRIO GRID gids straight from raw lat/long arrays in one pass
+def lat_long_to_gid(lat, long, spine_gids=None):
+    return center_to_gid(to_pg_center(lat), to_pg_center(long), spine_gids)
+
+
+# Method to add pg_lat, pg_long and gid columns to a dataframe.
+# gid is a nullable Int64 column, <NA> where the coordinates are not valid.
+def assign_gid(df, lat_col="ActionGeo_Lat", long_col="ActionGeo_Long", spine_gids=None):
+    df["pg_lat"] = to_pg_center(df[lat_col])
+    df["pg_long"] = to_pg_center(df[long_col])
+    gid, valid = center_to_gid(df["pg_lat"], df["pg_long"], spine_gids)
+    df["gid"] = pd.Series(gid, index=df.index, dtype="Int64").mask(~valid)
+    return df
+
+
+# Method to check that the gid arithmetic agrees with a PRIO GRID spine file (gid, lat, lon)
+def check_spine(spine):
+    gid, valid = center_to_gid(spine["lat"], spine["lon"])
+    bad = ~valid | (gid != spine["gid"].to_numpy())
+    if bad.any():
+        raise ValueError(f"{int(bad.sum())} spine rows do not match the PRIO GRID numbering")
+    return True
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+# Local cache of query results pulled from hpcc-sql.wharton.upenn.edu.
+# Every result is one parquet file at CACHE_DIR/<table>/<partition>/<hash of the SQL>.parquet,
+# so a rerun only goes to the server for partitions (years) that are not on disk yet.
+CACHE_DIR = os.path.join(os.environ.get("HOME", "."), ".cache", "gdelt_sql")
+
+# Size limit of the cache. When it is exceeded the least recently used files are removed.
+CACHE_MAX_BYTES = 50 * 1024**3
+
+
+# Method to normalize a query so that formatting differences do not change the key
+def normalize_sql(sql):
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+# Method to get the cache file of a query for one table/partition
+def cache_path(sql, table, partition, cache_dir=CACHE_DIR):
+    key = hashlib.sha256(f"{table}\n{partition}\n{normalize_sql(sql)}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, str(table), str(partition), key + ".parquet")
+
+
+# Method to get a cached file, or create it with fetch(path) if it is not there yet.
+# fetch must write a parquet file at the path it is given. A hit only updates the
+# file's modification time, which is what the LRU eviction goes by.
+def cached_file(sql, table, partition, fetch, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    path = cache_path(sql, table, partition, cache_dir)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        fetch(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict(cache_dir, max_bytes)
+    return path
+
+
+# Method to use instead of pd.read_sql: reads from the cache and only queries the server on a miss
+def cached_read_sql(sql, con, table, partition, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, **kwargs):
+    def fetch(path):
+        pd.read_sql(sql, con, **kwargs).to_parquet(path, index=False)
+
+    return pd.read_parquet(cached_file(sql, table, partition, fetch, cache_dir, max_bytes))
+
+
+# Method to drop cached results of a table, either one partition or all of them
+def invalidate(table, partition=None, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, str(table))
+    if partition is not None:
+        path = os.path.join(path, str(partition))
+    shutil.rmtree(path, ignore_errors=True)
+
+
+# Method to remove the least recently used files until the cache fits in max_bytes
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total